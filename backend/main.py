@@ -1,35 +1,137 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Header, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Header, Depends, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
-from groq import Groq
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from groq import AsyncGroq, DefaultAioHttpClient
+from contextlib import asynccontextmanager
+import asyncio
+import httpx
 import os
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import Client, ClientOptions
+from postgrest import SyncPostgrestClient
+from postgrest.exceptions import APIError
 import tempfile
 import shutil
 from datetime import datetime
-from PyPDF2 import PdfReader
-import io
-import json
+import pypdfium2 as pdfium
+import threading
+import orjson
+import hashlib
 from typing import Optional, List
-import random
-import string
-import re
+from functools import lru_cache
+from cachetools import TTLCache
+from aiolimiter import AsyncLimiter
+import secrets
+import bisect
+import ahocorasick
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import jwt
 import subprocess
 
 load_dotenv()
 
+# Groq client (free!) - used for both Whisper transcription AND LLaMA chat.
+# Created in lifespan so the aiohttp connection pool lives on the server's event loop.
+groq_client: AsyncGroq = None
+
+# Per-model request budgets so bursts queue here instead of tripping Groq 429s
+# (created in lifespan, they're loop-bound)
+chat_limiter: AsyncLimiter = None
+whisper_limiter: AsyncLimiter = None
+
+# Caps concurrent Whisper requests across all uploads (created in lifespan, it's loop-bound)
+transcription_slots: asyncio.Semaphore = None
+
+# Worker processes for PDF text extraction (pure-Python and CPU-bound, so threads won't help)
+pdf_pool: ProcessPoolExecutor = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global groq_client, pdf_pool, transcription_slots, chat_limiter, whisper_limiter
+    groq_client = AsyncGroq(
+        api_key=os.getenv("GROQ_API_KEY"),
+        max_retries=GROQ_MAX_RETRIES,  # the SDK backs off with jitter and honours Retry-After on 429s
+        http_client=DefaultAioHttpClient(
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=30.0),
+            timeout=httpx.Timeout(60.0, connect=5.0)
+        )
+    )
+    transcription_slots = asyncio.Semaphore(MAX_CONCURRENT_TRANSCRIPTIONS)
+    chat_limiter = AsyncLimiter(GROQ_CHAT_REQUESTS_PER_MINUTE, 60)
+    whisper_limiter = AsyncLimiter(GROQ_WHISPER_REQUESTS_PER_MINUTE, 60)
+    # spawn, not fork: the server process already runs threads (run_query, aiohttp)
+    pdf_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context('spawn'))
+    like_batcher.start()
+    try:
+        yield
+    finally:
+        await like_batcher.stop()
+        await groq_client.close()
+        pdf_pool.shutdown(cancel_futures=True)
+
+
 # Initialize
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)  # orjson serializes responses several times faster
 
-# Groq client (free!) - used for both Whisper transcription AND LLaMA chat
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# PostgREST connection pool shared by the worker threads in run_query
+SUPABASE_POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30)
 
-# Supabase client
-supabase: Client = create_client(
+
+class PooledPostgrestClient(SyncPostgrestClient):
+    """PostgREST client whose HTTP/2 session uses SUPABASE_POOL_LIMITS"""
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None) -> httpx.Client:
+        return httpx.Client(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            verify=verify,
+            proxy=proxy,
+            follow_redirects=True,
+            http2=True,
+            limits=SUPABASE_POOL_LIMITS,
+        )
+
+
+class PooledClient(Client):
+    """Supabase client that builds PooledPostgrestClient (it's rebuilt on every auth event)"""
+
+    @staticmethod
+    def _init_postgrest_client(rest_url, headers, schema, timeout, verify=True, proxy=None):
+        return PooledPostgrestClient(
+            rest_url, headers=headers, schema=schema, timeout=timeout, verify=verify, proxy=proxy
+        )
+
+
+# Supabase client (sync, shared by the worker threads in run_query; fail fast on connect)
+supabase: Client = PooledClient.create(
     os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_KEY")
+    os.getenv("SUPABASE_KEY"),
+    options=ClientOptions(postgrest_client_timeout=httpx.Timeout(30.0, connect=5.0))
 )
 
+# Supabase signs access tokens with the project's JWT secret, so they can be
+# verified locally instead of asking Supabase Auth on every request
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+_token_cache = TTLCache(maxsize=10_000, ttl=30)
+
+
+async def run_query(query):
+    """Execute a (blocking) Supabase query in a worker thread so the event loop stays free"""
+    return await asyncio.to_thread(query.execute)
+
+
+def pop_embedded_count(row: dict, table: str) -> int:
+    """
+    Remove an embedded `table(count)` aggregate from a row and return the count
+    (PostgREST counts the children in the same query and returns [{'count': n}])
+    """
+    embedded = row.pop(table)
+    return embedded[0]['count'] if embedded else 0
+
 # CORS for frontend
 ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -45,14 +147,33 @@ app.add_middleware(
     allow_origin_regex=r"https://.*\.vercel\.app",
 )
 
+# Compress larger JSON responses (lists repeat the same keys a lot)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # ============================================
 # CONSTANTS
 # ============================================
 LIKES_BEFORE_ANALYSIS = 5  # Analyze after this many new likes
+MAX_LIKED_CONTENT_CHARS = 5000  # Stored (and analyzed) prefix of a liked response
 MAX_CONTEXT_CHARS = 48000
+MAX_HISTORY_MESSAGES = 10  # Chat turns sent back to the model with each question
+MAX_HISTORY_MESSAGE_CHARS = 2000
+MAX_HISTORY_CHARS = 8000
 MAX_AUDIO_SIZE_MB = 25  # Groq's limit
 CHUNK_SIZE_MB = 20  # Split into chunks smaller than limit
 CHUNK_DURATION_MINUTES = 10  # Target chunk duration for splitting
+MAX_CONCURRENT_TRANSCRIPTIONS = 6  # Whisper requests in flight at once (Groq rate limits)
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.mp4', '.ogg', '.flac', '.webm')
+AUDIO_EXTENSION_SET = frozenset(AUDIO_EXTENSIONS)  # O(1) membership for upload validation
+LANGUAGE_NAMES = {'en': 'English', 'it': 'Italian', 'de': 'German', 'es': 'Spanish', 'fr': 'French'}  # Whisper languages offered
+GROQ_CHAT_REQUESTS_PER_MINUTE = int(os.getenv("GROQ_CHAT_RPM", "30"))  # Free tier defaults
+GROQ_WHISPER_REQUESTS_PER_MINUTE = int(os.getenv("GROQ_WHISPER_RPM", "20"))
+GROQ_MAX_RETRIES = 3
+CLASS_CODE_ATTEMPTS = 3  # Retries when a generated class code is already taken
+CLASS_CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'  # 32 chars (no I/O/0/1), so 5 random bits pick one
+CLASS_CODE_LENGTH = 6
+TOPIC_RETRIEVAL_CHUNKS = 20  # Chunks (~2000 chars each) sent for topics over MAX_CONTEXT_CHARS
+PDF_PAGES_PER_WORKER = 8  # Minimum pages per worker task when fanning a PDF out
 
 
 # ============================================
@@ -61,8 +182,7 @@ CHUNK_DURATION_MINUTES = 10  # Target chunk duration for splitting
 
 def generate_class_code():
     """Generate a 6-character class code"""
-    chars = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
-    return ''.join(random.choices(chars, k=6))
+    return ''.join(CLASS_CODE_ALPHABET[b & 0x1F] for b in secrets.token_bytes(CLASS_CODE_LENGTH))
 
 
 async def get_current_user(authorization: Optional[str] = Header(None)):
@@ -71,8 +191,18 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
         return None
     try:
         token = authorization.replace('Bearer ', '')
-        user_response = supabase.auth.get_user(token)
+        if token in _token_cache:
+            return _token_cache[token]
+        if SUPABASE_JWT_SECRET:
+            try:
+                payload = jwt.decode(token, SUPABASE_JWT_SECRET, algorithms=['HS256'], audience='authenticated')
+                _token_cache[token] = payload['sub']
+                return payload['sub']
+            except jwt.InvalidTokenError:
+                pass  # e.g. asymmetric signing keys - let Supabase Auth decide
+        user_response = await asyncio.to_thread(supabase.auth.get_user, token)
         if user_response and user_response.user:
+            _token_cache[token] = user_response.user.id
             return user_response.user.id
         return None
     except Exception as e:
@@ -90,11 +220,12 @@ async def require_auth(authorization: Optional[str] = Header(None)):
 
 async def check_class_membership(user_id: str, class_id: str):
     """Check if user is a member of the class"""
-    result = supabase.table('class_members')\
-        .select('id')\
-        .eq('user_id', user_id)\
-        .eq('class_id', class_id)\
-        .execute()
+    result = await run_query(
+        supabase.table('class_members')
+            .select('id')
+            .eq('user_id', user_id)
+            .eq('class_id', class_id)
+    )
     return len(result.data) > 0
 
 
@@ -102,6 +233,19 @@ async def check_class_membership(user_id: str, class_id: str):
 # AUDIO PROCESSING HELPERS
 # ============================================
 
+async def save_upload_to_temp(upload: UploadFile, suffix: str = None) -> str:
+    """Stream an upload into a temp file (1MB at a time, off the event loop) and return its path"""
+    if suffix is None:
+        suffix = os.path.splitext(upload.filename)[1]
+    
+    def copy() -> str:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+            shutil.copyfileobj(upload.file, tmp, length=1024 * 1024)
+            return tmp.name
+    
+    return await asyncio.to_thread(copy)
+
+
 def get_audio_duration(file_path: str) -> float:
     """Get audio duration in seconds using ffprobe"""
     try:
@@ -179,16 +323,18 @@ def split_audio_file(input_path: str, chunk_duration_seconds: int = 600) -> List
         return [input_path]  # Return original on error
 
 
-def transcribe_audio_chunk(file_path: str, language: str = "en") -> dict:
+async def transcribe_audio_chunk(file_path: str, language: str = "en") -> dict:
     """Transcribe a single audio chunk"""
     try:
-        with open(file_path, "rb") as audio_file:
-            transcription = groq_client.audio.transcriptions.create(
-                file=(os.path.basename(file_path), audio_file.read()),
-                model="whisper-large-v3",
-                response_format="verbose_json",
-                language=language
-            )
+        # Pass the open file so the upload streams from disk instead of being read into memory
+        async with transcription_slots, whisper_limiter:
+            with open(file_path, "rb") as audio_file:
+                transcription = await groq_client.audio.transcriptions.create(
+                    file=(os.path.basename(file_path), audio_file),
+                    model="whisper-large-v3",
+                    response_format="verbose_json",
+                    language=language
+                )
         
         # Get duration
         duration_seconds = 0
@@ -208,44 +354,154 @@ def transcribe_audio_chunk(file_path: str, language: str = "en") -> dict:
         raise
 
 
+# ============================================
+# PDF PROCESSING HELPERS
+# ============================================
+
+# PDFium is not thread-safe, so calls into it are serialized per process
+# (each pdf_pool worker only runs one task at a time anyway)
+_pdfium_lock = threading.Lock()
+
+
+def pdf_page_count(pdf_path: str) -> int:
+    """Number of pages in a PDF"""
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+
+def _extract_pdf_pages(pdf_path: str, page_numbers: list) -> list:
+    """Extract text of the given 1-based pages (module-level so worker processes can run it)"""
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            texts = []
+            for page_num in page_numbers:
+                page = pdf[page_num - 1]
+                textpage = page.get_textpage()
+                texts.append(textpage.get_text_range().replace('\r\n', '\n'))
+                textpage.close()
+                page.close()
+            return texts
+        finally:
+            pdf.close()
+
+
+async def run_pdf_task(func, *args):
+    """
+    Run a PDF helper in a pdf_pool worker, keeping PDF parsing out of the server process
+    (falls back to a thread when the pool isn't running, e.g. outside the app lifespan)
+    """
+    if pdf_pool is None:
+        return await asyncio.to_thread(func, *args)
+    return await asyncio.get_running_loop().run_in_executor(pdf_pool, func, *args)
+
+
+async def count_pdf_pages(pdf_path: str) -> int:
+    """Number of pages in a PDF (counted in a worker)"""
+    return await run_pdf_task(pdf_page_count, pdf_path)
+
+
+async def extract_pdf_text(pdf_path: str, page_numbers: list) -> list:
+    """
+    Extract text for each page in page_numbers, in order.
+    Workers open the file themselves, so the PDF is never pickled across processes.
+    Larger selections are split into one contiguous run per worker process -
+    each worker parses the PDF once and extracts its run of pages.
+    """
+    run_size = max(PDF_PAGES_PER_WORKER, -(-len(page_numbers) // (os.cpu_count() or 1)))
+    runs = [page_numbers[i:i + run_size] for i in range(0, len(page_numbers), run_size)]
+    
+    results = await asyncio.gather(*[
+        run_pdf_task(_extract_pdf_pages, pdf_path, run) for run in runs
+    ])
+    return [text for run_texts in results for text in run_texts]
+
+
 # ============================================
 # SELF-LEARNING PERSONALIZATION SYSTEM
 # ============================================
 
+# Keyword phrases for analyze_response_content, matched in a single
+# Aho-Corasick pass built once at import. PREFIX entries match at the
+# start of a word (e.g. "analog" -> analogy, analogous).
+EXAMPLE_PHRASES = [
+    "for example", "for instance", "such as", "like when",
+    "imagine", "consider", "let's say", "suppose"
+]
+ANALOGY_PHRASES = [
+    "like a", "just like", "similar to", "think of it as", "imagine a", "picture"
+]
+ANALOGY_PREFIXES = ["analog", "metaphor"]
+DEFINITION_PHRASES = [
+    "is defined as", "means that", "refers to", "in other words", "simply put", "definition"
+]
+
+
+def _build_keyword_automaton() -> ahocorasick.Automaton:
+    automaton = ahocorasick.Automaton()
+    for category, phrases, whole_word in (
+        ('example', EXAMPLE_PHRASES, True),
+        ('analogy', ANALOGY_PHRASES, True),
+        ('analogy', ANALOGY_PREFIXES, False),
+        ('definition', DEFINITION_PHRASES, True),
+    ):
+        for phrase in phrases:
+            automaton.add_word(phrase, (category, len(phrase), whole_word))
+    automaton.make_automaton()
+    return automaton
+
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton()
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == '_'
+
+
 def analyze_response_content(content: str) -> dict:
     """Analyze a response to extract learning style indicators (NO AI needed!)"""
     
-    # Check for bullet points
-    has_bullet_points = bool(re.search(r'^[\s]*[-•*]', content, re.MULTILINE))
-    
-    # Check for numbered steps
-    has_numbered_steps = bool(re.search(r'^[\s]*\d+[.)]', content, re.MULTILINE))
-    step_count = len(re.findall(r'^[\s]*\d+[.)]', content, re.MULTILINE))
-    
-    # Check for examples (keywords)
-    example_patterns = [
-        r'\bfor example\b', r'\bfor instance\b', r'\bsuch as\b',
-        r'\blike when\b', r'\bimagine\b', r'\bconsider\b',
-        r'\blet\'s say\b', r'\bsuppose\b'
-    ]
-    example_count = sum(len(re.findall(p, content, re.IGNORECASE)) for p in example_patterns)
+    # Check for bullet points and numbered steps in a single pass over the lines
+    has_bullet_points = False
+    step_count = 0
+    for line in content.split('\n'):
+        stripped = line.lstrip()
+        if not stripped:
+            continue
+        if stripped[0] in '-•*':
+            has_bullet_points = True
+        elif stripped[0].isdecimal():
+            i = 1
+            while i < len(stripped) and stripped[i].isdecimal():
+                i += 1
+            if i < len(stripped) and stripped[i] in '.)':
+                step_count += 1
+    has_numbered_steps = step_count > 0
+    
+    # Check for examples, analogies and definitions (keywords) in one pass
+    lowered = content.lower()
+    example_count = 0
+    has_analogies = False
+    has_definitions = False
+    for end, (category, length, whole_word) in _KEYWORD_AUTOMATON.iter(lowered):
+        start = end - length + 1
+        # Keywords must start (and unless a prefix, end) on a word boundary
+        if start > 0 and _is_word_char(lowered[start - 1]):
+            continue
+        if whole_word and end + 1 < len(lowered) and _is_word_char(lowered[end + 1]):
+            continue
+        if category == 'example':
+            example_count += 1
+        elif category == 'analogy':
+            has_analogies = True
+        else:
+            has_definitions = True
     has_examples = example_count > 0
     
-    # Check for analogies
-    analogy_patterns = [
-        r'\blike a\b', r'\bjust like\b', r'\bsimilar to\b',
-        r'\bthink of it as\b', r'\bimagine a\b', r'\bpicture\b',
-        r'\banalog', r'\bmetaphor'
-    ]
-    has_analogies = any(re.search(p, content, re.IGNORECASE) for p in analogy_patterns)
-    
-    # Check for definitions
-    definition_patterns = [
-        r'\bis defined as\b', r'\bmeans that\b', r'\brefers to\b',
-        r'\bin other words\b', r'\bsimply put\b', r'\bdefinition\b'
-    ]
-    has_definitions = any(re.search(p, content, re.IGNORECASE) for p in definition_patterns)
-    
     return {
         'response_length': len(content),
         'has_bullet_points': has_bullet_points,
@@ -258,26 +514,33 @@ def analyze_response_content(content: str) -> dict:
     }
 
 
-def calculate_learning_profile(liked_responses: list) -> dict:
-    """Calculate learning type scores from liked responses (NO AI needed!)"""
+# Average liked-response length bands -> detail_level
+# Short: <500, Medium: 500-1500, Long: >1500
+DETAIL_LENGTH_BOUNDS = (500, 1000, 1500)
+DETAIL_LEVELS = (25, 50, 70, 90)
+
+
+def calculate_learning_profile(stats: dict) -> dict:
+    """
+    Calculate learning type scores from liked responses (NO AI needed!)
+    `stats` is the row of totals returned by the analyze_likes() database function.
+    """
     
-    if not liked_responses:
+    if not stats or not stats['like_count']:
         return None
     
-    n = len(liked_responses)
+    n = stats['like_count']
     
     # Aggregate metrics
-    total_length = sum(r['response_length'] for r in liked_responses)
-    avg_length = total_length / n
+    avg_length = stats['total_length'] / n
     
-    bullet_count = sum(1 for r in liked_responses if r['has_bullet_points'])
-    step_count = sum(1 for r in liked_responses if r['has_numbered_steps'])
-    example_count = sum(1 for r in liked_responses if r['has_examples'])
-    analogy_count = sum(1 for r in liked_responses if r['has_analogies'])
-    definition_count = sum(1 for r in liked_responses if r['has_definitions'])
+    bullet_count = stats['bullet_count']
+    step_count = stats['numbered_count']
+    example_count = stats['example_count']
+    analogy_count = stats['analogy_count']
+    definition_count = stats['definition_count']
     
-    total_steps = sum(r['step_count'] for r in liked_responses)
-    total_examples = sum(r['example_count'] for r in liked_responses)
+    total_examples = stats['total_examples']
     
     # Calculate scores (0-100)
     
@@ -299,15 +562,7 @@ def calculate_learning_profile(liked_responses: list) -> dict:
     theory_vs_example = min(100, int((example_count / n) * 70 + (total_examples / max(1, n)) * 10))
     
     # Detail level (based on average length)
-    # Short: <500, Medium: 500-1500, Long: >1500
-    if avg_length < 500:
-        detail_level = 25
-    elif avg_length < 1000:
-        detail_level = 50
-    elif avg_length < 1500:
-        detail_level = 70
-    else:
-        detail_level = 90
+    detail_level = DETAIL_LEVELS[bisect.bisect_right(DETAIL_LENGTH_BOUNDS, avg_length)]
     
     # Structure preference (0=prose, 100=structured)
     structure_preference = min(100, int(
@@ -325,17 +580,33 @@ def calculate_learning_profile(liked_responses: list) -> dict:
     }
 
 
-def get_learned_profile(user_id: str) -> dict:
+# Learned profiles only change when likes are analyzed or learning is reset,
+# so keep recent lookups (and the prompt text built from them) in memory,
+# invalidated by those two paths via forget_learned_profile
+_profile_cache = TTLCache(maxsize=10_000, ttl=300)
+_personalization_cache = TTLCache(maxsize=10_000, ttl=300)
+
+
+def forget_learned_profile(user_id: str):
+    """Drop cached profile state for a user after it changes"""
+    _profile_cache.pop(user_id, None)
+    _personalization_cache.pop(user_id, None)
+
+
+async def get_learned_profile(user_id: str) -> dict:
     """Get user's learned profile"""
+    if user_id in _profile_cache:
+        return _profile_cache[user_id]
     try:
-        result = supabase.table('learned_profiles')\
-            .select('*')\
-            .eq('user_id', user_id)\
-            .execute()
+        result = await run_query(
+            supabase.table('learned_profiles')
+                .select('*')
+                .eq('user_id', user_id)
+        )
         
-        if result.data:
-            return result.data[0]
-        return None
+        profile = result.data[0] if result.data else None
+        _profile_cache[user_id] = profile
+        return profile
     except:
         return None
 
@@ -346,13 +617,45 @@ def build_personalization_from_profile(profile: dict) -> str:
     if not profile or profile.get('total_likes', 0) < LIKES_BEFORE_ANALYSIS:
         return ""  # Not enough data yet
     
+    return _build_personalization(
+        profile.get('visual_score', 50),
+        profile.get('verbal_score', 50),
+        profile.get('reading_writing_score', 50),
+        profile.get('theory_vs_example', 50),
+        profile.get('detail_level', 50),
+        profile.get('structure_preference', 50)
+    )
+
+
+async def get_personalization(user_id: str) -> str:
+    """Personalization prompt text for a user (cached per user)"""
+    if user_id in _personalization_cache:
+        return _personalization_cache[user_id]
+    personalization = build_personalization_from_profile(await get_learned_profile(user_id))
+    _personalization_cache[user_id] = personalization
+    return personalization
+
+
+async def personalization_for(authorization: Optional[str]) -> str:
+    """Personalization prompt text for the caller ("" when anonymous)"""
+    user_id = await get_current_user(authorization)
+    if not user_id:
+        return ""
+    return await get_personalization(user_id)
+
+
+@lru_cache(maxsize=4096)
+def _build_personalization(visual: int, verbal: int, reading_writing: int,
+                           theory_example: int, detail: int, structure: int) -> str:
+    """Prompt text for one set of scores (cached - scores only change when a profile is re-analyzed)"""
+    
     parts = ["\n\nPERSONALIZATION (adapt your response based on learned preferences):"]
     
     # Visual vs Verbal vs Reading/Writing
     scores = {
-        'visual': profile.get('visual_score', 50),
-        'verbal': profile.get('verbal_score', 50),
-        'reading_writing': profile.get('reading_writing_score', 50)
+        'visual': visual,
+        'verbal': verbal,
+        'reading_writing': reading_writing
     }
     dominant = max(scores, key=scores.get)
     
@@ -364,21 +667,18 @@ def build_personalization_from_profile(profile: dict) -> str:
         parts.append("- Use STRUCTURED FORMAT with clear definitions. Lists and organized points work well.")
     
     # Theory vs Example
-    theory_example = profile.get('theory_vs_example', 50)
     if theory_example < 35:
         parts.append("- Start with the CONCEPT/THEORY first, then provide examples to illustrate.")
     elif theory_example > 65:
         parts.append("- Start with CONCRETE EXAMPLES first, then explain the underlying concept.")
     
     # Detail level
-    detail = profile.get('detail_level', 50)
     if detail < 35:
         parts.append("- Keep responses CONCISE and to-the-point. Avoid unnecessary detail.")
     elif detail > 65:
         parts.append("- Provide COMPREHENSIVE explanations with full context and background.")
     
     # Structure preference
-    structure = profile.get('structure_preference', 50)
     if structure > 65:
         parts.append("- Use BULLET POINTS and NUMBERED STEPS. Organize information clearly.")
     elif structure < 35:
@@ -390,27 +690,46 @@ def build_personalization_from_profile(profile: dict) -> str:
     return "\n".join(parts)
 
 
+# Users with a profile analysis scheduled or running; like_response skips
+# scheduling another one until it finishes, so runs never overlap per user
+_profile_analysis_in_flight = set()
+
+
 async def maybe_analyze_and_update_profile(user_id: str):
-    """Check if we have enough new likes to update the profile"""
+    """
+    Update the learned profile if enough new likes are pending.
+    Runs as a background task after /responses/like; clears the user's in-flight mark when done.
+    """
+    try:
+        await _analyze_and_update_profile(user_id)
+    finally:
+        _profile_analysis_in_flight.discard(user_id)
+
+
+async def _analyze_and_update_profile(user_id: str):
+    """Blend the pending likes into the user's learned profile (see maybe_analyze_and_update_profile)"""
     
-    # Get unprocessed liked responses
-    liked_result = supabase.table('liked_responses')\
-        .select('*')\
-        .eq('user_id', user_id)\
-        .execute()
+    # Aggregate unprocessed liked responses (summed server-side) while the
+    # current profile is fetched - neither depends on the other
+    stats, profile = await asyncio.gather(
+        run_query(supabase.rpc('analyze_likes', {'uid': user_id})),
+        get_learned_profile(user_id)
+    )
+    stats = stats.data[0]
+    like_count = stats['like_count']
+    total_likes = profile['total_likes'] if profile else 0
     
-    if len(liked_result.data) < LIKES_BEFORE_ANALYSIS:
+    if like_count < LIKES_BEFORE_ANALYSIS:
         return  # Not enough data yet
     
-    # Get or create profile
-    profile = get_learned_profile(user_id)
-    
     # Calculate new scores from liked responses
-    new_scores = calculate_learning_profile(liked_result.data)
+    new_scores = calculate_learning_profile(stats)
     
     if not new_scores:
         return
     
+    total_likes += like_count
+    
     if profile:
         # Blend old and new scores (weighted average)
         old_weight = min(0.7, profile['total_likes'] / 50)  # Old data gets more weight as it grows
@@ -423,30 +742,120 @@ async def maybe_analyze_and_update_profile(user_id: str):
             'theory_vs_example': int(profile['theory_vs_example'] * old_weight + new_scores['theory_vs_example'] * new_weight),
             'detail_level': int(profile['detail_level'] * old_weight + new_scores['detail_level'] * new_weight),
             'structure_preference': int(profile['structure_preference'] * old_weight + new_scores['structure_preference'] * new_weight),
-            'total_likes': profile['total_likes'] + len(liked_result.data),
-            'last_analyzed_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat()
+            'total_likes': total_likes
         }
-        
-        supabase.table('learned_profiles')\
-            .update(updated_scores)\
-            .eq('user_id', user_id)\
-            .execute()
     else:
-        # Create new profile
-        new_scores['user_id'] = user_id
-        new_scores['total_likes'] = len(liked_result.data)
-        new_scores['last_analyzed_at'] = datetime.now().isoformat()
-        
-        supabase.table('learned_profiles').insert(new_scores).execute()
+        # New profile
+        updated_scores = {**new_scores, 'total_likes': total_likes}
+    
+    # Save the profile and delete the liked responses it was computed from in one
+    # transaction (last_analyzed_at / updated_at are stamped by the database)
+    await run_query(supabase.rpc('save_learned_profile', {
+        'uid': user_id, 'scores': updated_scores, 'liked_ids': stats['liked_ids']
+    }))
     
-    # Delete processed liked responses to save space
-    supabase.table('liked_responses')\
-        .delete()\
-        .eq('user_id', user_id)\
-        .execute()
+    forget_learned_profile(user_id)
     
-    print(f"✨ Updated learning profile for user {user_id[:8]}... ({len(liked_result.data)} likes processed)")
+    print(f"✨ Updated learning profile for user {user_id[:8]}... ({like_count} likes processed)")
+
+
+class LikeBatcher:
+    """
+    Buffers liked_responses inserts and writes them with one record_likes() call
+    once MAX_BATCH rows are queued or the oldest row is MAX_WAIT seconds old.
+    """
+
+    def __init__(self, max_batch: int = 32, max_wait: float = 0.01, add_timeout: float = 15.0):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.add_timeout = add_timeout  # Callers give up instead of hanging if a write never finishes
+        self.queue: asyncio.Queue = None
+        self.task: asyncio.Task = None
+        self.accepting = False
+
+    _STOP = object()  # Queued by stop(): everything before it is still written
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.accepting = True
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop taking rows, then let the runner finish its current flush and write out the rest"""
+        self.accepting = False
+        self.queue.put_nowait(self._STOP)
+        await self.task
+
+    async def add(self, row: dict) -> tuple:
+        """
+        Queue a row and wait until it is written.
+        Returns (pending_likes, first_in_flush): the user's pending like count
+        after the write, and True for the first like of each user in a flush -
+        that caller should run the profile analysis (so it runs once per user per flush).
+        """
+        if not self.accepting:
+            raise RuntimeError("Like batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((row, future))
+        return await asyncio.wait_for(future, self.add_timeout)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is self._STOP:
+                return
+            batch = [item]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            # Any error fails this batch's callers but never stops the loop
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                print(f"Like batch error: {e}")
+                self._fail(batch, e)
+
+    @staticmethod
+    def _fail(batch: list, error: Exception):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _flush(self, batch: list):
+        try:
+            result = await run_query(supabase.rpc('record_likes', {'likes': [row for row, _ in batch]}))
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Like insert error: {e}")
+                self._fail(batch, e)
+                return
+            # record_likes is one transaction, so nothing was written: retry each
+            # row on its own so one bad row only fails its own caller
+            print(f"Like batch insert error, retrying {len(batch)} rows one by one: {e}")
+            await asyncio.gather(*[self._flush([item]) for item in batch])
+            return
+        
+        pending = {r['uid']: r['pending_likes'] for r in result.data or []}
+        seen_users = set()
+        for row, future in batch:
+            if not future.done():
+                future.set_result((pending.get(row['user_id'], 0), row['user_id'] not in seen_users))
+            seen_users.add(row['user_id'])
+
+
+like_batcher = LikeBatcher()
 
 
 # ============================================
@@ -455,6 +864,7 @@ async def maybe_analyze_and_update_profile(user_id: str):
 
 @app.post("/responses/like")
 async def like_response(
+    background_tasks: BackgroundTasks,
     response_content: str = Form(...),
     question_asked: str = Form(...),
     mode: str = Form("tutor"),
@@ -462,14 +872,16 @@ async def like_response(
 ):
     """Like a response - triggers learning system"""
     try:
-        # Analyze content (no AI needed!)
-        analysis = analyze_response_content(response_content)
+        # Analyze content (no AI needed!) - only the part we store, so huge pastes stay cheap
+        content = response_content[:MAX_LIKED_CONTENT_CHARS]
+        analysis = analyze_response_content(content)
         
-        # Store liked response
-        supabase.table('liked_responses').insert({
+        # Store liked response (batched with other likes arriving at the same time)
+        # while the profile is read for total_processed
+        (pending_likes, first_in_flush), profile = await asyncio.gather(like_batcher.add({
             'user_id': user_id,
-            'response_content': response_content[:5000],  # Truncate to save space
-            'response_length': analysis['response_length'],
+            'response_content': content,  # Truncated to save space
+            'response_length': len(response_content),  # Full length is the detail signal
             'question_asked': question_asked[:500],
             'mode': mode,
             'has_bullet_points': analysis['has_bullet_points'],
@@ -479,20 +891,15 @@ async def like_response(
             'has_definitions': analysis['has_definitions'],
             'step_count': analysis['step_count'],
             'example_count': analysis['example_count']
-        }).execute()
-        
-        # Check if we should update profile
-        await maybe_analyze_and_update_profile(user_id)
-        
-        # Get current like count
-        likes_result = supabase.table('liked_responses')\
-            .select('id', count='exact')\
-            .eq('user_id', user_id)\
-            .execute()
-        
-        profile = get_learned_profile(user_id)
+        }), get_learned_profile(user_id))
         total_processed = profile['total_likes'] if profile else 0
-        pending_likes = likes_result.count
+        
+        # Check if we should update profile (after the response is sent - the
+        # caller only needs to know the like was stored)
+        if (first_in_flush and pending_likes >= LIKES_BEFORE_ANALYSIS
+                and user_id not in _profile_analysis_in_flight):
+            _profile_analysis_in_flight.add(user_id)
+            background_tasks.add_task(maybe_analyze_and_update_profile, user_id)
         
         return {
             'success': True,
@@ -511,21 +918,31 @@ async def like_response(
 async def get_learning_status(user_id: str = Depends(require_auth)):
     """Get learning system status (minimal info - no details shown)"""
     try:
-        # Count pending likes
-        likes_result = supabase.table('liked_responses')\
-            .select('id', count='exact')\
-            .eq('user_id', user_id)\
-            .execute()
-        
-        profile = get_learned_profile(user_id)
+        # Count pending likes while the profile is fetched. The exact count comes
+        # back in the Content-Range header, so one row is enough (head=True would
+        # skip rows entirely, but this postgrest-py version reads a HEAD response's
+        # empty body as count=0)
+        likes_result, profile = await asyncio.gather(
+            run_query(
+                supabase.table('liked_responses')
+                    .select('id', count='exact')
+                    .eq('user_id', user_id)
+                    .limit(1)
+            ),
+            get_learned_profile(user_id)
+        )
         
         if profile and profile['total_likes'] >= LIKES_BEFORE_ANALYSIS:
             status = "active"
             message = "AI is personalized to your learning style"
         elif profile or likes_result.count > 0:
             status = "learning"
-            remaining = LIKES_BEFORE_ANALYSIS - likes_result.count
-            message = f"Like {remaining} more responses to activate personalization"
+            # Pending likes can exceed the threshold while an analysis runs (or after one failed)
+            remaining = max(0, LIKES_BEFORE_ANALYSIS - likes_result.count)
+            if remaining:
+                message = f"Like {remaining} more responses to activate personalization"
+            else:
+                message = "Learning from your liked responses"
         else:
             status = "inactive"
             message = "Like responses you find helpful to activate personalization"
@@ -545,16 +962,20 @@ async def reset_learning(user_id: str = Depends(require_auth)):
     """Reset all learned preferences"""
     try:
         # Delete learned profile
-        supabase.table('learned_profiles')\
-            .delete()\
-            .eq('user_id', user_id)\
-            .execute()
+        await run_query(
+            supabase.table('learned_profiles')
+                .delete()
+                .eq('user_id', user_id)
+        )
         
         # Delete pending likes
-        supabase.table('liked_responses')\
-            .delete()\
-            .eq('user_id', user_id)\
-            .execute()
+        await run_query(
+            supabase.table('liked_responses')
+                .delete()
+                .eq('user_id', user_id)
+        )
+        
+        forget_learned_profile(user_id)
         
         return {
             'success': True,
@@ -577,7 +998,7 @@ async def signup(
 ):
     """Create a new user account"""
     try:
-        result = supabase.auth.sign_up({
+        result = await asyncio.to_thread(supabase.auth.sign_up, {
             "email": email,
             "password": password,
             "options": {"data": {"name": name}}
@@ -604,7 +1025,7 @@ async def login(
 ):
     """Log in and get access token"""
     try:
-        result = supabase.auth.sign_in_with_password({
+        result = await asyncio.to_thread(supabase.auth.sign_in_with_password, {
             "email": email,
             "password": password
         })
@@ -626,10 +1047,12 @@ async def login(
 
 
 @app.post("/auth/logout")
-async def logout(user_id: str = Depends(require_auth)):
+async def logout(authorization: Optional[str] = Header(None), user_id: str = Depends(require_auth)):
     """Log out"""
+    # Stop honouring this token from the auth cache straight away
+    _token_cache.pop(authorization.replace('Bearer ', ''), None)
     try:
-        supabase.auth.sign_out()
+        await asyncio.to_thread(supabase.auth.sign_out)
         return {"success": True, "message": "Logged out"}
     except:
         return {"success": True, "message": "Logged out"}
@@ -639,7 +1062,8 @@ async def request_password_reset(email: str = Form(...)):
     """Request a password reset email"""
     try:
         # Supabase sends a reset email with a link to your site
-        supabase.auth.reset_password_email(
+        await asyncio.to_thread(
+            supabase.auth.reset_password_email,
             email,
             options={
                 "redirect_to": "https://lecture-lessons.vercel.app/reset-password"
@@ -671,10 +1095,10 @@ async def reset_password(
         # The frontend extracts access_token from URL hash after user clicks email link
         
         # Create a new client session with the recovery token
-        supabase.auth.set_session(access_token, "")
+        await asyncio.to_thread(supabase.auth.set_session, access_token, "")
         
         # Update the user's password
-        result = supabase.auth.update_user({
+        result = await asyncio.to_thread(supabase.auth.update_user, {
             "password": new_password
         })
         
@@ -698,10 +1122,11 @@ async def get_me(authorization: Optional[str] = Header(None)):
     if not user_id:
         return {"authenticated": False}
     
-    classes_result = supabase.table('class_members')\
-        .select('class_id, role, classes(id, name, class_code)')\
-        .eq('user_id', user_id)\
-        .execute()
+    classes_result = await run_query(
+        supabase.table('class_members')
+            .select('class_id, role, classes(id, name, class_code)')
+            .eq('user_id', user_id)
+    )
     
     return {
         "authenticated": True,
@@ -722,35 +1147,35 @@ async def create_class(
 ):
     """Create a new class"""
     try:
-        class_code = generate_class_code()
-        
-        while True:
-            existing = supabase.table('classes').select('id').eq('class_code', class_code).execute()
-            if not existing.data:
-                break
+        # Uniqueness is enforced by the classes_class_code_key constraint -
+        # just insert and pick a new code on the (rare) collision.
+        # The class and its teacher membership are created in one call.
+        class_id = None
+        for _ in range(CLASS_CODE_ATTEMPTS):
             class_code = generate_class_code()
+            try:
+                class_id = (await run_query(supabase.rpc('create_class_with_owner', {
+                    'class_name': name,
+                    'class_description': description,
+                    'owner': user_id,
+                    'code': class_code
+                }))).data
+                break
+            except APIError as e:
+                if e.code != '23505':  # unique_violation
+                    raise
         
-        class_result = supabase.table('classes').insert({
-            'name': name,
-            'description': description,
-            'class_code': class_code,
-            'created_by': user_id
-        }).execute()
-        
-        class_data = class_result.data[0]
-        
-        supabase.table('class_members').insert({
-            'user_id': user_id,
-            'class_id': class_data['id'],
-            'role': 'teacher'
-        }).execute()
+        if class_id is None:
+            raise HTTPException(500, "Could not generate a unique class code")
         
         return {
             "success": True,
-            "class_id": class_data['id'],
+            "class_id": class_id,
             "class_code": class_code,
             "name": name
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, f"Failed to create class: {str(e)}")
 
@@ -763,31 +1188,33 @@ async def join_class(
 ):
     """Join a class"""
     try:
-        class_result = supabase.table('classes')\
-            .select('id, name')\
-            .eq('class_code', class_code.upper())\
-            .execute()
+        class_result = await run_query(
+            supabase.table('classes')
+                .select('id, name')
+                .eq('class_code', class_code.upper())
+        )
         
         if not class_result.data:
             raise HTTPException(404, "Invalid class code")
         
         class_data = class_result.data[0]
         
-        existing = supabase.table('class_members')\
-            .select('id')\
-            .eq('user_id', user_id)\
-            .eq('class_id', class_data['id'])\
-            .execute()
+        existing = await run_query(
+            supabase.table('class_members')
+                .select('id')
+                .eq('user_id', user_id)
+                .eq('class_id', class_data['id'])
+        )
         
         if existing.data:
             return {"success": True, "already_member": True, "class_id": class_data['id']}
         
-        supabase.table('class_members').insert({
+        await run_query(supabase.table('class_members').insert({
             'user_id': user_id,
             'class_id': class_data['id'],
             'role': 'student',
             'display_name': display_name or None
-        }).execute()
+        }))
         
         return {"success": True, "class_id": class_data['id'], "class_name": class_data['name']}
     except HTTPException:
@@ -800,22 +1227,17 @@ async def join_class(
 async def list_my_classes(user_id: str = Depends(require_auth)):
     """List user's classes"""
     try:
-        result = supabase.table('class_members')\
-            .select('role, display_name, joined_at, classes(id, name, description, class_code, created_at)')\
-            .eq('user_id', user_id)\
-            .execute()
+        result = await run_query(
+            supabase.table('class_members')
+                .select('role, display_name, joined_at, classes(id, name, description, class_code, created_at, subjects(count))')
+                .eq('user_id', user_id)
+        )
         
         classes = []
         for membership in result.data:
             class_data = membership['classes']
             class_data['role'] = membership['role']
-            
-            subjects_count = supabase.table('subjects')\
-                .select('id', count='exact')\
-                .eq('class_id', class_data['id'])\
-                .execute()
-            class_data['subject_count'] = subjects_count.count
-            
+            class_data['subject_count'] = pop_embedded_count(class_data, 'subjects')
             classes.append(class_data)
         
         return classes
@@ -829,7 +1251,7 @@ async def get_class(class_id: str, user_id: str = Depends(require_auth)):
     if not await check_class_membership(user_id, class_id):
         raise HTTPException(403, "Not a member of this class")
     
-    result = supabase.table('classes').select('*').eq('id', class_id).execute()
+    result = await run_query(supabase.table('classes').select('*').eq('id', class_id))
     if not result.data:
         raise HTTPException(404, "Class not found")
     return result.data[0]
@@ -838,7 +1260,7 @@ async def get_class(class_id: str, user_id: str = Depends(require_auth)):
 @app.delete("/classes/{class_id}/leave")
 async def leave_class(class_id: str, user_id: str = Depends(require_auth)):
     """Leave a class"""
-    supabase.table('class_members').delete().eq('user_id', user_id).eq('class_id', class_id).execute()
+    await run_query(supabase.table('class_members').delete().eq('user_id', user_id).eq('class_id', class_id))
     return {"success": True}
 
 
@@ -857,9 +1279,9 @@ async def create_subject_in_class(
     if not await check_class_membership(user_id, class_id):
         raise HTTPException(403, "Not a member of this class")
     
-    result = supabase.table('subjects').insert({
+    result = await run_query(supabase.table('subjects').insert({
         'name': name, 'description': description, 'class_id': class_id
-    }).execute()
+    }))
     return result.data[0]
 
 
@@ -869,11 +1291,12 @@ async def list_class_subjects(class_id: str, user_id: str = Depends(require_auth
     if not await check_class_membership(user_id, class_id):
         raise HTTPException(403, "Not a member of this class")
     
-    subjects = supabase.table('subjects').select('*').eq('class_id', class_id).order('name').execute().data
+    subjects = (await run_query(
+        supabase.table('subjects').select('*, topics(count)').eq('class_id', class_id).order('name')
+    )).data
     
     for subject in subjects:
-        topics = supabase.table('topics').select('id', count='exact').eq('subject_id', subject['id']).execute()
-        subject['topic_count'] = topics.count
+        subject['topic_count'] = pop_embedded_count(subject, 'topics')
     
     return subjects
 
@@ -884,28 +1307,20 @@ async def list_class_lectures(class_id: str, user_id: str = Depends(require_auth
     if not await check_class_membership(user_id, class_id):
         raise HTTPException(403, "Not a member of this class")
     
-    # Get all subjects for this class
-    subjects = supabase.table('subjects').select('id').eq('class_id', class_id).execute()
-    if not subjects.data:
-        return []
-    
-    subject_ids = [s['id'] for s in subjects.data]
-    
-    # Get all topics for these subjects
-    topics = supabase.table('topics').select('id').in_('subject_id', subject_ids).execute()
-    if not topics.data:
-        return []
+    # One request: inner-join lectures to their topic's subject and filter on its class
+    lectures = (await run_query(
+        supabase.table('lectures')
+            .select('id, title, recording_date, audio_duration_seconds, created_at, topic_id, '
+                    'topics!inner(subjects!inner(class_id))')
+            .eq('topics.subjects.class_id', class_id)
+            .order('created_at', desc=True)
+    )).data
     
-    topic_ids = [t['id'] for t in topics.data]
+    # The embed is only there for the filter
+    for lecture in lectures:
+        del lecture['topics']
     
-    # Get all lectures for these topics
-    lectures = supabase.table('lectures')\
-        .select('id, title, recording_date, audio_duration_seconds, created_at, topic_id')\
-        .in_('topic_id', topic_ids)\
-        .order('created_at', desc=True)\
-        .execute()
-    
-    return lectures.data
+    return lectures
 
 
 @app.post("/subjects")
@@ -918,22 +1333,21 @@ async def create_subject(
     data = {'name': name, 'description': description}
     if class_id:
         data['class_id'] = class_id
-    result = supabase.table('subjects').insert(data).execute()
+    result = await run_query(supabase.table('subjects').insert(data))
     return result.data[0]
 
 
 @app.get("/subjects")
 async def list_subjects(class_id: str = None):
     """List subjects"""
-    query = supabase.table('subjects').select('*')
+    query = supabase.table('subjects').select('*, topics(count)')
     if class_id:
         query = query.eq('class_id', class_id)
     
-    subjects = query.order('name').execute().data
+    subjects = (await run_query(query.order('name'))).data
     
     for subject in subjects:
-        topics = supabase.table('topics').select('id', count='exact').eq('subject_id', subject['id']).execute()
-        subject['topic_count'] = topics.count
+        subject['topic_count'] = pop_embedded_count(subject, 'topics')
     
     return subjects
 
@@ -945,20 +1359,21 @@ async def list_subjects(class_id: str = None):
 @app.post("/subjects/{subject_id}/topics")
 async def create_topic(subject_id: str, name: str = Form(...), description: str = Form("")):
     """Create a topic"""
-    result = supabase.table('topics').insert({
+    result = await run_query(supabase.table('topics').insert({
         'subject_id': subject_id, 'name': name, 'description': description
-    }).execute()
+    }))
     return result.data[0]
 
 
 @app.get("/subjects/{subject_id}/topics")
 async def list_topics(subject_id: str):
     """List topics in a subject"""
-    topics = supabase.table('topics').select('*').eq('subject_id', subject_id).order('name').execute().data
+    topics = (await run_query(
+        supabase.table('topics').select('*, lectures(count)').eq('subject_id', subject_id).order('name')
+    )).data
     
     for topic in topics:
-        lectures = supabase.table('lectures').select('id', count='exact').eq('topic_id', topic['id']).execute()
-        topic['lecture_count'] = lectures.count
+        topic['lecture_count'] = pop_embedded_count(topic, 'lectures')
     
     return topics
 
@@ -966,17 +1381,18 @@ async def list_topics(subject_id: str):
 @app.get("/topics/{topic_id}/lectures")
 async def list_topic_lectures(topic_id: str):
     """List lectures in a topic"""
-    return supabase.table('lectures')\
-        .select('id, title, recording_date, audio_duration_seconds, created_at')\
-        .eq('topic_id', topic_id)\
-        .order('created_at', desc=False)\
-        .execute().data
+    return (await run_query(
+        supabase.table('lectures')
+            .select('id, title, recording_date, audio_duration_seconds, created_at')
+            .eq('topic_id', topic_id)
+            .order('created_at', desc=False)
+    )).data
 
 
 @app.get("/topics/{topic_id}")
 async def get_topic(topic_id: str):
     """Get a single topic"""
-    result = supabase.table('topics').select('*').eq('id', topic_id).execute()
+    result = await run_query(supabase.table('topics').select('*').eq('id', topic_id))
     if not result.data:
         raise HTTPException(404, "Topic not found")
     return result.data[0]
@@ -985,7 +1401,7 @@ async def get_topic(topic_id: str):
 @app.get("/subjects/{subject_id}")
 async def get_subject(subject_id: str):
     """Get a single subject"""
-    result = supabase.table('subjects').select('*').eq('id', subject_id).execute()
+    result = await run_query(supabase.table('subjects').select('*').eq('id', subject_id))
     if not result.data:
         raise HTTPException(404, "Subject not found")
     return result.data[0]
@@ -995,26 +1411,62 @@ async def get_subject(subject_id: str):
 # LECTURES
 # ============================================
 
+# Lecture rows only change through the endpoints below, so keep recent reads
+# in memory and drop them whenever a lecture or material is created, moved or deleted
+_lecture_cache = TTLCache(maxsize=1000, ttl=60)
+_lecture_list_cache = TTLCache(maxsize=1, ttl=30)
+# Assembled /ask contexts (transcripts + material text), keyed by lecture/topic id
+_lecture_context_cache = TTLCache(maxsize=64, ttl=600)
+_topic_context_cache = TTLCache(maxsize=64, ttl=600)
+
+
+def invalidate_lecture_cache():
+    """Forget cached lecture reads and study contexts after a write"""
+    _lecture_cache.clear()
+    _lecture_list_cache.clear()
+    _lecture_context_cache.clear()
+    _topic_context_cache.clear()
+
+
 @app.get("/lectures")
-async def list_lectures():
-    """List all lectures"""
-    return supabase.table('lectures')\
-        .select('id, title, recording_date, audio_duration_seconds, created_at')\
-        .order('created_at', desc=True)\
-        .execute().data
+async def list_lectures(limit: Optional[int] = Query(None, ge=1, le=200), before: Optional[str] = None):
+    """
+    List all lectures, newest first.
+    Pass limit (and the created_at of the last lecture seen as before) to page through them.
+    """
+    paged = limit is not None or before is not None
+    if not paged and 'all' in _lecture_list_cache:
+        return _lecture_list_cache['all']
+    query = (
+        supabase.table('lectures')
+            .select('id, title, recording_date, audio_duration_seconds, created_at')
+            .order('created_at', desc=True)
+    )
+    if before:
+        query = query.lt('created_at', before)
+    if limit:
+        query = query.limit(limit)
+    lectures = (await run_query(query)).data
+    if not paged:
+        _lecture_list_cache['all'] = lectures
+    return lectures
 
 
 @app.get("/lectures/{lecture_id}")
 async def get_lecture(lecture_id: str):
     """Get a lecture"""
-    result = supabase.table('lectures').select('*').eq('id', lecture_id).execute()
+    if lecture_id in _lecture_cache:
+        return _lecture_cache[lecture_id]
+    result = await run_query(supabase.table('lectures').select('*').eq('id', lecture_id))
     if not result.data:
         raise HTTPException(404, "Lecture not found")
+    _lecture_cache[lecture_id] = result.data[0]
     return result.data[0]
 
 
-@app.post("/transcribe")
+@app.post("/transcribe", status_code=202)
 async def transcribe_lecture(
+    background_tasks: BackgroundTasks,
     audio: UploadFile = File(...),
     title: str = Form("Untitled Lecture"),
     topic_id: str = Form(None),
@@ -1023,32 +1475,26 @@ async def transcribe_lecture(
     """
     Transcribe audio using Groq's Whisper API.
     Automatically splits files >25MB into chunks.
-    Generates both cleaned transcript and summary.
+    The cleaned transcript and summary are generated in the background
+    (poll GET /lectures/{id} until processing_status is 'ready').
     """
     
     # Validate file type
-    valid_extensions = ('.mp3', '.wav', '.m4a', '.mp4', '.ogg', '.flac', '.webm')
-    if not audio.filename.lower().endswith(valid_extensions):
-        raise HTTPException(400, f"Invalid format. Supported: {', '.join(valid_extensions)}")
+    ext = os.path.splitext(audio.filename)[1].lower()
+    if ext not in AUDIO_EXTENSION_SET:
+        raise HTTPException(400, f"Invalid format. Supported: {', '.join(AUDIO_EXTENSIONS)}")
     
     # Validate language
-    valid_languages = ['en', 'it', 'de', 'es', 'fr']
-    if language not in valid_languages:
+    if language not in LANGUAGE_NAMES:
         language = 'en'
     
     temp_files = []
     
     try:
-        # Read file and check size
-        audio_content = await audio.read()
-        file_size_mb = len(audio_content) / (1024 * 1024)
-        
-        # Save to temp file
-        suffix = os.path.splitext(audio.filename)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(audio_content)
-            tmp_path = tmp.name
-            temp_files.append(tmp_path)
+        # Save to temp file and check size
+        tmp_path = await save_upload_to_temp(audio, suffix=ext)
+        temp_files.append(tmp_path)
+        file_size_mb = os.path.getsize(tmp_path) / (1024 * 1024)
         
         all_transcripts = []
         total_duration = 0
@@ -1057,66 +1503,40 @@ async def transcribe_lecture(
         if file_size_mb > MAX_AUDIO_SIZE_MB:
             print(f"📦 File is {file_size_mb:.1f}MB, splitting into chunks...")
             
-            # Split the audio file
-            chunk_paths = split_audio_file(tmp_path, CHUNK_DURATION_MINUTES * 60)
+            # Split the audio file (ffmpeg runs in a worker thread)
+            chunk_paths = await asyncio.to_thread(split_audio_file, tmp_path, CHUNK_DURATION_MINUTES * 60)
             temp_files.extend([p for p in chunk_paths if p != tmp_path])
             
             print(f"📦 Split into {len(chunk_paths)} chunks")
             
-            # Transcribe each chunk
-            for i, chunk_path in enumerate(chunk_paths):
-                print(f"🎤 Transcribing chunk {i+1}/{len(chunk_paths)}...")
-                result = transcribe_audio_chunk(chunk_path, language)
-                all_transcripts.append(result['text'])
-                total_duration += result['duration']
+            # Transcribe all chunks concurrently (bounded by MAX_CONCURRENT_TRANSCRIPTIONS)
+            print(f"🎤 Transcribing {len(chunk_paths)} chunks...")
+            results = await asyncio.gather(*[
+                transcribe_audio_chunk(chunk_path, language) for chunk_path in chunk_paths
+            ])
+            all_transcripts = [r['text'] for r in results]
+            total_duration = sum(r['duration'] for r in results)
             
             raw_transcript = "\n\n".join(all_transcripts)
         else:
             # Single file transcription
-            result = transcribe_audio_chunk(tmp_path, language)
+            result = await transcribe_audio_chunk(tmp_path, language)
             raw_transcript = result['text']
             total_duration = result['duration']
         
-        # Clean transcript with LLaMA
-        print("✨ Cleaning transcript...")
-        cleaned_transcript = clean_transcript_with_groq(raw_transcript, title)
-        
-        # Generate summary
-        print("📝 Generating summary...")
-        summary = generate_summary_with_groq(cleaned_transcript, title)
-        
-        # Save to database
-        lecture_data = {
-            'title': title,
-            'raw_transcript': raw_transcript,
-            'cleaned_transcript': cleaned_transcript,
-            'summary': summary,  # NEW FIELD
-            'audio_duration_seconds': total_duration,
-            'recording_date': datetime.now().isoformat()
-        }
-        if topic_id:
-            lecture_data['topic_id'] = topic_id
-        
-        result = supabase.table('lectures').insert(lecture_data).execute()
-        
-        # Get language name for response
-        language_names = {
-            'en': 'English', 'it': 'Italian', 'de': 'German', 
-            'es': 'Spanish', 'fr': 'French'
-        }
+        lecture_id = await save_raw_lecture(title, topic_id, raw_transcript, total_duration)
+        background_tasks.add_task(finish_lecture_processing, lecture_id, raw_transcript, title)
         
         return {
-            'lecture_id': result.data[0]['id'],
+            'lecture_id': lecture_id,
             'title': title,
             'duration_seconds': total_duration,
             'raw_length': len(raw_transcript),
-            'cleaned_length': len(cleaned_transcript),
-            'summary_length': len(summary),  # NEW
-            'cleaned_preview': cleaned_transcript[:500],
+            'transcript_preview': raw_transcript[:500],
             'language': language,
-            'language_name': language_names.get(language, 'Unknown'),
+            'language_name': LANGUAGE_NAMES[language],
             'chunks_processed': len(all_transcripts) if file_size_mb > MAX_AUDIO_SIZE_MB else 1,
-            'status': 'success'
+            'status': 'processing'
         }
         
     except HTTPException:
@@ -1132,8 +1552,9 @@ async def transcribe_lecture(
                 pass
 
 
-@app.post("/transcribe-multi")
+@app.post("/transcribe-multi", status_code=202)
 async def transcribe_multiple_files(
+    background_tasks: BackgroundTasks,
     audio_files: List[UploadFile] = File(...),
     title: str = Form("Untitled Lecture"),
     topic_id: str = Form(None),
@@ -1142,13 +1563,10 @@ async def transcribe_multiple_files(
     """
     Transcribe multiple audio files and combine into one lecture.
     Useful for lectures recorded in multiple parts.
-    Generates both cleaned transcript and summary.
+    The cleaned transcript and summary are generated in the background.
     """
     
-    valid_extensions = ('.mp3', '.wav', '.m4a', '.mp4', '.ogg', '.flac', '.webm')
-    valid_languages = ['en', 'it', 'de', 'es', 'fr']
-    
-    if language not in valid_languages:
+    if language not in LANGUAGE_NAMES:
         language = 'en'
     
     if not audio_files:
@@ -1159,95 +1577,72 @@ async def transcribe_multiple_files(
     
     # Validate all files first
     for audio in audio_files:
-        if not audio.filename.lower().endswith(valid_extensions):
-            raise HTTPException(400, f"Invalid format for {audio.filename}. Supported: {', '.join(valid_extensions)}")
+        if os.path.splitext(audio.filename)[1].lower() not in AUDIO_EXTENSION_SET:
+            raise HTTPException(400, f"Invalid format for {audio.filename}. Supported: {', '.join(AUDIO_EXTENSIONS)}")
     
     temp_files = []
-    all_transcripts = []
-    total_duration = 0
+    
+    async def save_and_split(i: int, audio: UploadFile) -> List[str]:
+        """Save one upload to disk and return its chunk paths"""
+        print(f"📁 Processing file {i}/{len(audio_files)}: {audio.filename}")
+        
+        # Save to temp file
+        tmp_path = await save_upload_to_temp(audio)
+        temp_files.append(tmp_path)
+        file_size_mb = os.path.getsize(tmp_path) / (1024 * 1024)
+        
+        # Check if this file needs splitting
+        if file_size_mb > MAX_AUDIO_SIZE_MB:
+            print(f"  📦 File {i} is {file_size_mb:.1f}MB, splitting...")
+            chunk_paths = await asyncio.to_thread(split_audio_file, tmp_path, CHUNK_DURATION_MINUTES * 60)
+            temp_files.extend([p for p in chunk_paths if p != tmp_path])
+            return chunk_paths
+        return [tmp_path]
     
     try:
-        for i, audio in enumerate(audio_files, 1):
-            print(f"📁 Processing file {i}/{len(audio_files)}: {audio.filename}")
-            
-            # Read and save to temp file
-            audio_content = await audio.read()
-            file_size_mb = len(audio_content) / (1024 * 1024)
-            
-            suffix = os.path.splitext(audio.filename)[1]
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-                tmp.write(audio_content)
-                tmp_path = tmp.name
-                temp_files.append(tmp_path)
-            
-            # Check if this file needs splitting
-            if file_size_mb > MAX_AUDIO_SIZE_MB:
-                print(f"  📦 File is {file_size_mb:.1f}MB, splitting...")
-                chunk_paths = split_audio_file(tmp_path, CHUNK_DURATION_MINUTES * 60)
-                temp_files.extend([p for p in chunk_paths if p != tmp_path])
-                
-                for j, chunk_path in enumerate(chunk_paths):
-                    print(f"  🎤 Transcribing chunk {j+1}/{len(chunk_paths)}...")
-                    result = transcribe_audio_chunk(chunk_path, language)
-                    all_transcripts.append(result['text'])
-                    total_duration += result['duration']
-            else:
-                print(f"  🎤 Transcribing...")
-                result = transcribe_audio_chunk(tmp_path, language)
-                all_transcripts.append(result['text'])
-                total_duration += result['duration']
+        # Save and split all files concurrently (ffmpeg runs in worker threads).
+        # Let every file finish before raising, so all temp files get cleaned up.
+        file_chunks = await asyncio.gather(*[
+            save_and_split(i, audio) for i, audio in enumerate(audio_files, 1)
+        ], return_exceptions=True)
+        for chunk_paths in file_chunks:
+            if isinstance(chunk_paths, BaseException):
+                raise chunk_paths
+        
+        # Transcribe every chunk of every file concurrently (bounded by MAX_CONCURRENT_TRANSCRIPTIONS)
+        all_chunk_paths = [p for chunk_paths in file_chunks for p in chunk_paths]
+        print(f"🎤 Transcribing {len(all_chunk_paths)} chunks...")
+        results = iter(await asyncio.gather(*[
+            transcribe_audio_chunk(chunk_path, language) for chunk_path in all_chunk_paths
+        ]))
+        file_results = [[next(results) for _ in chunk_paths] for chunk_paths in file_chunks]
+        
+        all_transcripts = [r['text'] for chunk_results in file_results for r in chunk_results]
+        total_duration = sum(r['duration'] for chunk_results in file_results for r in chunk_results)
         
         # Combine all transcripts with part markers
         if len(audio_files) > 1:
-            raw_transcript = ""
-            transcript_idx = 0
-            for i, audio in enumerate(audio_files, 1):
-                raw_transcript += f"\n\n--- Part {i}: {audio.filename} ---\n\n"
-                raw_transcript += all_transcripts[transcript_idx]
-                transcript_idx += 1
+            raw_transcript = "".join(
+                f"\n\n--- Part {i}: {audio.filename} ---\n\n" + "\n\n".join(r['text'] for r in chunk_results)
+                for i, (audio, chunk_results) in enumerate(zip(audio_files, file_results), 1)
+            )
         else:
             raw_transcript = "\n\n".join(all_transcripts)
         
-        # Clean transcript
-        print("✨ Cleaning transcript...")
-        cleaned_transcript = clean_transcript_with_groq(raw_transcript, title)
-        
-        # Generate summary
-        print("📝 Generating summary...")
-        summary = generate_summary_with_groq(cleaned_transcript, title)
-        
-        # Save to database
-        lecture_data = {
-            'title': title,
-            'raw_transcript': raw_transcript,
-            'cleaned_transcript': cleaned_transcript,
-            'summary': summary,  # NEW FIELD
-            'audio_duration_seconds': total_duration,
-            'recording_date': datetime.now().isoformat()
-        }
-        if topic_id:
-            lecture_data['topic_id'] = topic_id
-        
-        result = supabase.table('lectures').insert(lecture_data).execute()
-        
-        language_names = {
-            'en': 'English', 'it': 'Italian', 'de': 'German', 
-            'es': 'Spanish', 'fr': 'French'
-        }
+        lecture_id = await save_raw_lecture(title, topic_id, raw_transcript, total_duration)
+        background_tasks.add_task(finish_lecture_processing, lecture_id, raw_transcript, title)
         
         return {
-            'lecture_id': result.data[0]['id'],
+            'lecture_id': lecture_id,
             'title': title,
             'duration_seconds': total_duration,
             'raw_length': len(raw_transcript),
-            'cleaned_length': len(cleaned_transcript),
-            'summary_length': len(summary),  # NEW
-            'cleaned_preview': cleaned_transcript[:500],
+            'transcript_preview': raw_transcript[:500],
             'language': language,
-            'language_name': language_names.get(language, 'Unknown'),
+            'language_name': LANGUAGE_NAMES[language],
             'files_processed': len(audio_files),
             'total_chunks': len(all_transcripts),
-            'status': 'success'
+            'status': 'processing'
         }
         
     except HTTPException:
@@ -1263,7 +1658,60 @@ async def transcribe_multiple_files(
                 pass
 
 
-def clean_transcript_with_groq(raw_text: str, subject_context: str) -> str:
+async def save_raw_lecture(title: str, topic_id: Optional[str], raw_transcript: str, total_duration: int) -> str:
+    """
+    Insert a freshly transcribed lecture and return its id.
+    The raw transcript stands in as cleaned_transcript until cleaning finishes,
+    so the lecture can already be studied.
+    """
+    lecture_data = {
+        'title': title,
+        'raw_transcript': raw_transcript,
+        'cleaned_transcript': raw_transcript,
+        'audio_duration_seconds': total_duration,
+        'recording_date': datetime.now().isoformat(),
+        'processing_status': 'processing'
+    }
+    if topic_id:
+        lecture_data['topic_id'] = topic_id
+    
+    result = await run_query(supabase.table('lectures').insert(lecture_data))
+    invalidate_lecture_cache()
+    return result.data[0]['id']
+
+
+async def finish_lecture_processing(lecture_id: str, raw_transcript: str, title: str):
+    """
+    Background step after /transcribe: clean the transcript, summarize it and mark the lecture ready.
+    If a Groq step fails the lecture is marked 'failed', keeping whatever text it has by then
+    (the raw transcript if cleaning failed, the cleaned one if only the summary failed).
+    """
+    update = {'processing_status': 'ready'}
+    try:
+        # Clean transcript with LLaMA
+        print("✨ Cleaning transcript...")
+        update['cleaned_transcript'] = await clean_transcript_with_groq(raw_transcript, title)
+        
+        # Generate summary
+        print("📝 Generating summary...")
+        update['summary'] = await generate_summary_with_groq(update['cleaned_transcript'], title)
+    except Exception as e:
+        print(f"Lecture processing error for {lecture_id}: {e}")
+        update['processing_status'] = 'failed'
+    
+    try:
+        await run_query(supabase.table('lectures').update(update).eq('id', lecture_id))
+    except Exception as e:
+        print(f"Lecture processing save error for {lecture_id}: {e}")
+        try:
+            await run_query(supabase.table('lectures').update({'processing_status': 'failed'}).eq('id', lecture_id))
+        except Exception as e:
+            print(f"Could not mark lecture {lecture_id} as failed: {e}")
+    finally:
+        invalidate_lecture_cache()
+
+
+async def clean_transcript_with_groq(raw_text: str, subject_context: str) -> str:
     """Clean transcript with Groq"""
     prompt = f"""Clean this transcript. Fix errors, remove filler words, fix punctuation.
 DO NOT summarize. Keep original meaning.
@@ -1275,18 +1723,9 @@ Transcript:
 
 Return ONLY cleaned transcript:"""
 
-    try:
-        response = groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.3-70b-versatile",
-            temperature=0.3,
-            max_tokens=4096
-        )
-        return response.choices[0].message.content.strip()
-    except:
-        return raw_text
+    return await chat_completion([{"role": "user", "content": prompt}], temperature=0.3, max_tokens=4096)
 
-def generate_summary_with_groq(transcript: str, title: str) -> str:
+async def generate_summary_with_groq(transcript: str, title: str) -> str:
     """Generate an adaptive summary of the transcript.
     
     The summary length varies based on content density - 
@@ -1325,17 +1764,7 @@ TRANSCRIPT:
 
 SUMMARY:"""
 
-    try:
-        response = groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.3-70b-versatile",
-            temperature=0.3,
-            max_tokens=4096
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"Summary generation error: {e}")
-        return transcript[:3000] + "\n\n[Summary generation failed - truncated transcript]"
+    return await chat_completion([{"role": "user", "content": prompt}], temperature=0.3, max_tokens=4096)
 
 
 @app.post("/lectures/{lecture_id}/upload-pdf")
@@ -1348,10 +1777,11 @@ async def upload_pdf(
     if not pdf.filename.lower().endswith('.pdf'):
         raise HTTPException(400, "Must be PDF")
     
+    pdf_path = None
     try:
-        pdf_content = await pdf.read()
-        pdf_reader = PdfReader(io.BytesIO(pdf_content))
-        total_pages = len(pdf_reader.pages)
+        # Stream the upload to disk; PDFium opens it by path
+        pdf_path = await save_upload_to_temp(pdf)
+        total_pages = await count_pdf_pages(pdf_path)
         
         # Parse selected pages
         if selected_pages and selected_pages.strip():
@@ -1364,13 +1794,14 @@ async def upload_pdf(
             page_numbers = list(range(1, total_pages + 1))
         
         # Extract only selected pages
-        extracted_text = ""
-        for page_num in sorted(page_numbers):
-            page = pdf_reader.pages[page_num - 1]
-            page_text = page.extract_text() or ""
-            extracted_text += f"\n--- Page {page_num} ---\n{page_text}"
+        page_numbers_sorted = sorted(page_numbers)
+        page_texts = await extract_pdf_text(pdf_path, page_numbers_sorted)
+        extracted_text = "".join(
+            f"\n--- Page {page_num} ---\n{page_text}"
+            for page_num, page_text in zip(page_numbers_sorted, page_texts)
+        )
         
-        result = supabase.table('materials').insert({
+        result = await run_query(supabase.table('materials').insert({
             'lecture_id': lecture_id,
             'file_name': pdf.filename,
             'file_type': 'pdf',
@@ -1378,7 +1809,8 @@ async def upload_pdf(
             'page_count': len(page_numbers),
             'total_pages': total_pages,
             'selected_pages': ','.join(map(str, page_numbers))
-        }).execute()
+        }))
+        invalidate_lecture_cache()
         
         return {
             'material_id': result.data[0]['id'],
@@ -1390,6 +1822,9 @@ async def upload_pdf(
         }
     except Exception as e:
         raise HTTPException(500, f"PDF upload failed: {str(e)}")
+    finally:
+        if pdf_path:
+            os.unlink(pdf_path)
 
 
 
@@ -1397,16 +1832,18 @@ async def upload_pdf(
 @app.get("/lectures/{lecture_id}/materials")
 async def get_lecture_materials(lecture_id: str):
     """Get materials for a lecture"""
-    return supabase.table('materials')\
-        .select('id, file_name, file_type, created_at')\
-        .eq('lecture_id', lecture_id)\
-        .execute().data
+    return (await run_query(
+        supabase.table('materials')
+            .select('id, file_name, file_type, created_at')
+            .eq('lecture_id', lecture_id)
+    )).data
 
 
 @app.put("/lectures/{lecture_id}/topic")
 async def assign_lecture_to_topic(lecture_id: str, topic_id: str = Form(...)):
     """Assign lecture to topic"""
-    supabase.table('lectures').update({'topic_id': topic_id}).eq('id', lecture_id).execute()
+    await run_query(supabase.table('lectures').update({'topic_id': topic_id}).eq('id', lecture_id))
+    invalidate_lecture_cache()
     return {'success': True}
 
 
@@ -1425,14 +1862,15 @@ async def upload_topic_pdf(
         raise HTTPException(400, "Must be PDF")
     
     # Verify topic exists
-    topic = supabase.table('topics').select('id').eq('id', topic_id).execute()
+    topic = await run_query(supabase.table('topics').select('id').eq('id', topic_id))
     if not topic.data:
         raise HTTPException(404, "Topic not found")
     
+    pdf_path = None
     try:
-        pdf_content = await pdf.read()
-        pdf_reader = PdfReader(io.BytesIO(pdf_content))
-        total_pages = len(pdf_reader.pages)
+        # Stream the upload to disk; PDFium opens it by path
+        pdf_path = await save_upload_to_temp(pdf)
+        total_pages = await count_pdf_pages(pdf_path)
         
         # Parse selected pages
         if selected_pages and selected_pages.strip():
@@ -1445,13 +1883,14 @@ async def upload_topic_pdf(
             page_numbers = list(range(1, total_pages + 1))
         
         # Extract only selected pages
-        extracted_text = ""
-        for page_num in sorted(page_numbers):
-            page = pdf_reader.pages[page_num - 1]
-            page_text = page.extract_text() or ""
-            extracted_text += f"\n--- Page {page_num} ---\n{page_text}"
+        page_numbers_sorted = sorted(page_numbers)
+        page_texts = await extract_pdf_text(pdf_path, page_numbers_sorted)
+        extracted_text = "".join(
+            f"\n--- Page {page_num} ---\n{page_text}"
+            for page_num, page_text in zip(page_numbers_sorted, page_texts)
+        )
         
-        result = supabase.table('materials').insert({
+        result = await run_query(supabase.table('materials').insert({
             'topic_id': topic_id,
             'file_name': pdf.filename,
             'file_type': 'pdf',
@@ -1459,7 +1898,8 @@ async def upload_topic_pdf(
             'page_count': len(page_numbers),
             'total_pages': total_pages,
             'selected_pages': ','.join(map(str, page_numbers))
-        }).execute()
+        }))
+        invalidate_lecture_cache()
         
         return {
             'material_id': result.data[0]['id'],
@@ -1471,22 +1911,27 @@ async def upload_topic_pdf(
         }
     except Exception as e:
         raise HTTPException(500, f"PDF upload failed: {str(e)}")
+    finally:
+        if pdf_path:
+            os.unlink(pdf_path)
 
 
 
 @app.get("/topics/{topic_id}/materials")
 async def get_topic_materials(topic_id: str):
     """Get materials attached directly to a topic"""
-    return supabase.table('materials')\
-        .select('id, file_name, file_type, created_at')\
-        .eq('topic_id', topic_id)\
-        .execute().data
+    return (await run_query(
+        supabase.table('materials')
+            .select('id, file_name, file_type, created_at')
+            .eq('topic_id', topic_id)
+    )).data
 
 
 @app.delete("/materials/{material_id}")
 async def delete_material(material_id: str):
     """Delete a material (PDF)"""
-    supabase.table('materials').delete().eq('id', material_id).execute()
+    await run_query(supabase.table('materials').delete().eq('id', material_id))
+    invalidate_lecture_cache()
     return {'success': True}
 
 
@@ -1496,54 +1941,26 @@ async def delete_material(material_id: str):
 
 @app.delete("/lectures/{lecture_id}")
 async def delete_lecture(lecture_id: str):
-    supabase.table('materials').delete().eq('lecture_id', lecture_id).execute()
-    supabase.table('lectures').delete().eq('id', lecture_id).execute()
+    # Materials and the lecture are removed in one database call
+    await run_query(supabase.rpc('delete_lecture_cascade', {'lid': lecture_id}))
+    invalidate_lecture_cache()
     return {'success': True}
 
 
 @app.delete("/topics/{topic_id}")
 async def delete_topic(topic_id: str):
-    lectures = supabase.table('lectures').select('id').eq('topic_id', topic_id).execute().data
-    lecture_ids = [l['id'] for l in lectures]
-    
-    # Delete lecture-level materials
-    if lecture_ids:
-        supabase.table('materials').delete().in_('lecture_id', lecture_ids).execute()
-    
-    # Delete topic-level materials
-    supabase.table('materials').delete().eq('topic_id', topic_id).execute()
-    
-    supabase.table('lectures').delete().eq('topic_id', topic_id).execute()
-    supabase.table('topics').delete().eq('id', topic_id).execute()
-    
-    return {'success': True, 'deleted_lectures': len(lecture_ids)}
+    # Materials, lectures and the topic are removed in one database call
+    result = await run_query(supabase.rpc('delete_topic_cascade', {'tid': topic_id}))
+    invalidate_lecture_cache()
+    return {'success': True, 'deleted_lectures': result.data['deleted_lectures']}
 
 
 @app.delete("/subjects/{subject_id}")
 async def delete_subject(subject_id: str):
-    topics = supabase.table('topics').select('id').eq('subject_id', subject_id).execute().data
-    topic_ids = [t['id'] for t in topics]
-    
-    deleted_lectures = 0
-    
-    if topic_ids:
-        lectures = supabase.table('lectures').select('id').in_('topic_id', topic_ids).execute().data
-        lecture_ids = [l['id'] for l in lectures]
-        deleted_lectures = len(lecture_ids)
-        
-        # Delete lecture-level materials
-        if lecture_ids:
-            supabase.table('materials').delete().in_('lecture_id', lecture_ids).execute()
-        
-        # Delete topic-level materials
-        supabase.table('materials').delete().in_('topic_id', topic_ids).execute()
-        
-        supabase.table('lectures').delete().in_('topic_id', topic_ids).execute()
-    
-    supabase.table('topics').delete().eq('subject_id', subject_id).execute()
-    supabase.table('subjects').delete().eq('id', subject_id).execute()
-    
-    return {'success': True, 'deleted_topics': len(topic_ids), 'deleted_lectures': deleted_lectures}
+    # Materials, lectures, topics and the subject are removed in one database call
+    result = await run_query(supabase.rpc('delete_subject_cascade', {'sid': subject_id}))
+    invalidate_lecture_cache()
+    return {'success': True, 'deleted_topics': result.data['deleted_topics'], 'deleted_lectures': result.data['deleted_lectures']}
 
 
 # ============================================
@@ -1565,182 +1982,350 @@ FORMATTING GUIDELINES:
 """
 
 
-@app.post("/lectures/{lecture_id}/ask")
-async def ask_lecture_question(
-    lecture_id: str,
-    question: str = Form(...),
-    mode: str = Form("tutor"),
-    chat_history: str = Form("[]"),
-    authorization: Optional[str] = Header(None)
-):
-    """AI study assistant (personalized)"""
-    
-    user_id = await get_current_user(authorization)
-    personalization = ""
-    if user_id:
-        profile = get_learned_profile(user_id)
-        personalization = build_personalization_from_profile(profile)
+# Identical prompts (same context, question, history and personalization)
+# reuse the previous answer for an hour instead of re-running the 70B model
+_completion_cache = TTLCache(maxsize=1000, ttl=3600)
+
+
+def normalize_question(text: str) -> str:
+    """Case, spacing and trailing punctuation don't change what a question asks"""
+    return " ".join(text.casefold().split()).rstrip("?!. ")
+
+
+def _completion_key(messages: list, temperature: float, max_tokens: int, fuzzy_question: bool = False) -> str:
+    """
+    Cache key for a chat completion request.
+    With fuzzy_question (the /ask modes) the final user message is normalized, so
+    "What is velocity?" and "what is velocity" share an answer; other prompts are hashed verbatim.
+    """
+    if fuzzy_question and messages and messages[-1]["role"] == "user":
+        messages = messages[:-1] + [{"role": "user", "content": normalize_question(messages[-1]["content"])}]
+    return hashlib.blake2b(
+        orjson.dumps([messages, temperature, max_tokens]), digest_size=16
+    ).hexdigest()
+
+
+# Running totals of how much prompt text Groq served from its prompt cache
+# (the prompts are ordered static-first for this, see build_chat_messages)
+prompt_cache_stats = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0}
+
+
+def record_prompt_cache_usage(usage):
+    """Log a completion's cached vs total prompt tokens and add them to prompt_cache_stats"""
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)  # Not reported by older groq SDKs
+    cached = details.cached_tokens if details else 0
+    prompt_cache_stats['requests'] += 1
+    prompt_cache_stats['prompt_tokens'] += usage.prompt_tokens
+    prompt_cache_stats['cached_tokens'] += cached
+    print(f"🗄️ Prompt cache: {cached}/{usage.prompt_tokens} prompt tokens cached")
+
+
+async def chat_completion(messages: list, temperature: float, max_tokens: int, stream: bool = False,
+                          fuzzy_question: bool = False):
+    """
+    Run a LLaMA chat completion.
+    Returns the full response text, or with stream=True an async iterator of text deltas.
+    fuzzy_question lets trivially rephrased student questions share a cached answer.
+    """
+    key = _completion_key(messages, temperature, max_tokens, fuzzy_question)
+    cached = _completion_cache.get(key)
+    if cached is not None:
+        if not stream:
+            return cached
+        
+        async def replay():
+            yield cached
+        
+        return replay()
     
-    try:
-        history = json.loads(chat_history)[-10:]
-    except:
-        history = []
+    async with chat_limiter:
+        response = await groq_client.chat.completions.create(
+            messages=messages,
+            model="llama-3.3-70b-versatile",
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=stream
+        )
+    if not stream:
+        record_prompt_cache_usage(response.usage)
+        # No content is a failed completion, not an answer worth caching
+        text = (response.choices[0].message.content or "").strip()
+        if not text:
+            raise RuntimeError("Groq returned an empty completion")
+        _completion_cache[key] = text
+        return text
+    
+    async def deltas():
+        parts = []
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+            # Streams report usage once, on the final chunk
+            x_groq = getattr(chunk, 'x_groq', None)
+            if x_groq and x_groq.usage:
+                record_prompt_cache_usage(x_groq.usage)
+        # Only cache streams that ran to completion and produced an answer
+        text = "".join(parts).strip()
+        if text:
+            _completion_cache[key] = text
+    
+    return deltas()
+
+
+async def sse_events(deltas, **metadata):
+    """Wrap an async iterator of text deltas as Server-Sent Events"""
+    if metadata:
+        yield f"data: {orjson.dumps(metadata).decode()}\n\n"
+    async for delta in deltas:
+        yield f"data: {orjson.dumps({'delta': delta}).decode()}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def sse_response(deltas, **metadata) -> StreamingResponse:
+    """
+    StreamingResponse for sse_events.
+    Marked as already encoded so GZipMiddleware passes events through instead of buffering them.
+    """
+    return StreamingResponse(
+        sse_events(deltas, **metadata),
+        media_type="text/event-stream",
+        headers={'Content-Encoding': 'identity', 'Cache-Control': 'no-cache'}
+    )
+
+
+class ContextTooLarge(HTTPException):
+    """400 raised by ContextBuilder, so callers with a fallback can tell it apart"""
+
+
+class ContextBuilder:
+    """Collects prompt context parts, rejecting the request as soon as they outgrow MAX_CONTEXT_CHARS"""
+
+    def __init__(self, too_large_message: str):
+        self.parts = []
+        self.length = 0
+        self.too_large_message = too_large_message
+
+    def add(self, part: str):
+        self.length += len(part)
+        if self.length > MAX_CONTEXT_CHARS:
+            raise ContextTooLarge(400, self.too_large_message)
+        self.parts.append(part)
+
+    def build(self) -> str:
+        return "".join(self.parts)
+
+
+async def build_lecture_context(lecture_id: str) -> str:
+    """Lecture transcript plus its materials, assembled once per lecture until a write invalidates it"""
+    if lecture_id in _lecture_context_cache:
+        return _lecture_context_cache[lecture_id]
     
-    lecture = supabase.table('lectures')\
-        .select('title, cleaned_transcript')\
-        .eq('id', lecture_id).execute()
+    # Lecture with its materials embedded (one request)
+    lecture = await run_query(
+        supabase.table('lectures')
+            .select('title, cleaned_transcript, materials(file_name, extracted_text)')
+            .eq('id', lecture_id)
+    )
     
     if not lecture.data:
         raise HTTPException(404, "Lecture not found")
     
-    materials = supabase.table('materials')\
-        .select('file_name, extracted_text')\
-        .eq('lecture_id', lecture_id).execute()
+    materials = lecture.data[0]['materials']
     
-    context = f"LECTURE: {lecture.data[0]['title']}\n\nTRANSCRIPT:\n{lecture.data[0]['cleaned_transcript']}"
+    context = ContextBuilder("Content too large")
+    context.add(f"LECTURE: {lecture.data[0]['title']}\n\nTRANSCRIPT:\n{lecture.data[0]['cleaned_transcript']}")
     
-    if materials.data:
-        context += "\n\nMATERIALS:\n"
-        for m in materials.data:
-            context += f"\n--- {m['file_name']} ---\n{m['extracted_text']}"
+    if materials:
+        context.add("\n\nMATERIALS:\n")
+        for m in materials:
+            context.add(f"\n--- {m['file_name']} ---\n{m['extracted_text']}")
     
-    if len(context) > MAX_CONTEXT_CHARS:
-        raise HTTPException(400, "Content too large")
-    
-    if mode == "tutor":
-        response = await tutor_mode(context, question, history, personalization)
-    elif mode == "practice":
-        response = await practice_mode(context, question, history, personalization)
-    elif mode == "exam":
-        response = await exam_mode(context, question, history, personalization)
-    else:
-        raise HTTPException(400, "Invalid mode")
-    
-    return {'question': question, 'mode': mode, 'response': response}
+    context = context.build()
+    _lecture_context_cache[lecture_id] = context
+    return context
 
 
-@app.post("/topics/{topic_id}/ask")
-async def ask_topic_question(
-    topic_id: str,
-    question: str = Form(...),
-    mode: str = Form("tutor"),
-    chat_history: str = Form("[]"),
-    authorization: Optional[str] = Header(None)
-):
-    """AI study assistant for topic (personalized)"""
+async def build_topic_context(topic_id: str) -> str:
+    """All lectures and materials of a topic, assembled once per topic until a write invalidates it"""
+    if topic_id in _topic_context_cache:
+        return _topic_context_cache[topic_id]
     
-    user_id = await get_current_user(authorization)
-    personalization = ""
-    if user_id:
-        profile = get_learned_profile(user_id)
-        personalization = build_personalization_from_profile(profile)
+    # Lectures, topic-level materials (PDFs attached directly to topic) and
+    # lecture-level materials, fetched in one call
+    topic_context = (await run_query(supabase.rpc('get_topic_context', {'tid': topic_id}))).data
+    lectures = topic_context['lectures']
+    topic_materials = topic_context['topic_materials']
+    lecture_materials = topic_context['lecture_materials']
     
-    try:
-        history = json.loads(chat_history)[-10:]
-    except:
-        history = []
+    if not lectures:
+        raise HTTPException(404, "No lectures in this topic")
     
-    lectures = supabase.table('lectures')\
-        .select('id, title, cleaned_transcript')\
-        .eq('topic_id', topic_id).execute()
+    # Stops at the first part that pushes past MAX_CONTEXT_CHARS
+    context = ContextBuilder("Topic too large")
+    context.add(f"TOPIC ({len(lectures)} lectures):\n")
+    for i, lec in enumerate(lectures, 1):
+        context.add(f"\n--- Lecture {i}: {lec['title']} ---\n{lec['cleaned_transcript']}")
     
-    if not lectures.data:
-        raise HTTPException(404, "No lectures in this topic")
+    # Add topic-level materials first (shared resources)
+    if topic_materials:
+        context.add("\n\nTOPIC MATERIALS (shared across all lectures):\n")
+        for m in topic_materials:
+            context.add(f"\n--- {m['file_name']} ---\n{m['extracted_text']}")
     
-    # Get lecture-level materials
-    lecture_ids = [l['id'] for l in lectures.data]
-    lecture_materials = supabase.table('materials')\
-        .select('file_name, extracted_text')\
-        .in_('lecture_id', lecture_ids).execute()
+    # Add lecture-specific materials
+    if lecture_materials:
+        context.add("\n\nLECTURE MATERIALS:\n")
+        for m in lecture_materials:
+            context.add(f"\n--- {m['file_name']} ---\n{m['extracted_text']}")
+    
+    context = context.build()
+    _topic_context_cache[topic_id] = context
+    return context
+
+
+async def retrieve_topic_context(topic_id: str, question: str) -> str:
+    """
+    For topics too large to send whole: only the chunks that best match the question
+    (full-text ranked in the database, see migrations/013_context_chunks.sql)
+    """
+    chunks = (await run_query(supabase.rpc('match_topic_chunks', {
+        'tid': topic_id, 'query': question, 'k': TOPIC_RETRIEVAL_CHUNKS
+    }))).data
+    
+    if not chunks:
+        raise HTTPException(400, "Topic too large and no content matches the question")
+    
+    context = ContextBuilder("Topic too large")
+    context.add(f"TOPIC ({len(chunks)} excerpts most relevant to the question):\n")
+    for chunk in chunks:
+        context.add(f"\n--- {chunk['source']} ---\n{chunk['content']}")
+    return context.build()
+
+
+async def build_subject_context(subject_id: str) -> str:
+    """Every lecture of a subject, as its summary"""
+    # Fetch lectures with SUMMARY instead of full transcript
+    # (lecture_previews only carries a truncated transcript, and only when there's no summary)
+    lectures = await run_query(
+        supabase.table('lecture_previews')
+            .select('title, summary, transcript_preview')
+            .eq('subject_id', subject_id)
+            .order('created_at')
+    )
     
-    # Get topic-level materials (PDFs attached directly to topic)
-    topic_materials = supabase.table('materials')\
-        .select('file_name, extracted_text')\
-        .eq('topic_id', topic_id).execute()
+    if not lectures.data:
+        raise HTTPException(404, "No lectures")
     
-    context = f"TOPIC ({len(lectures.data)} lectures):\n"
+    # Build context using summaries (fall back to truncated transcript if no summary)
+    context = ContextBuilder("Subject too large (even with summaries)")
+    context.add(f"SUBJECT ({len(lectures.data)} lectures) - Using summaries for efficiency:\n")
     for i, lec in enumerate(lectures.data, 1):
-        context += f"\n--- Lecture {i}: {lec['title']} ---\n{lec['cleaned_transcript']}"
+        # Use summary if available, otherwise truncated transcript
+        content = lec.get('summary') or lec['transcript_preview']
+        context.add(f"\n--- Lecture {i}: {lec['title']} ---\n{content}")
     
-    # Add topic-level materials first (shared resources)
-    if topic_materials.data:
-        context += "\n\nTOPIC MATERIALS (shared across all lectures):\n"
-        for m in topic_materials.data:
-            context += f"\n--- {m['file_name']} ---\n{m['extracted_text']}"
+    return context.build()
+
+
+async def topic_context_for(topic_id: str, question: str) -> str:
+    """The whole topic when it fits, otherwise the excerpts relevant to the question"""
+    try:
+        return await build_topic_context(topic_id)
+    except ContextTooLarge:
+        return await retrieve_topic_context(topic_id, question)
+
+
+def parse_chat_history(chat_history: str) -> list:
+    """
+    Recent user/assistant messages of the JSON chat history sent by the client (empty if malformed),
+    rebuilt as {role, content} so no other keys reach the model.
+    Each message is capped at MAX_HISTORY_MESSAGE_CHARS, and the oldest ones are
+    dropped once the total passes MAX_HISTORY_CHARS, so long answers can't bloat every prompt.
+    """
+    try:
+        messages = orjson.loads(chat_history)[-MAX_HISTORY_MESSAGES:]
+    except:
+        return []
     
-    # Add lecture-specific materials
-    if lecture_materials.data:
-        context += "\n\nLECTURE MATERIALS:\n"
-        for m in lecture_materials.data:
-            context += f"\n--- {m['file_name']} ---\n{m['extracted_text']}"
-    
-    if len(context) > MAX_CONTEXT_CHARS:
-        raise HTTPException(400, "Topic too large")
-    
-    if mode == "tutor":
-        response = await tutor_mode(context, question, history, personalization)
-    elif mode == "practice":
-        response = await practice_mode(context, question, history, personalization)
-    elif mode == "exam":
-        response = await exam_mode(context, question, history, personalization)
-    else:
+    history = []
+    total = 0
+    for msg in reversed(messages):
+        # Only plain user/assistant turns - a client must not inject system prompts
+        if (not isinstance(msg, dict) or msg.get("role") not in ("user", "assistant")
+                or not isinstance(msg.get("content"), str)):
+            continue
+        content = msg["content"][:MAX_HISTORY_MESSAGE_CHARS]
+        total += len(content)
+        if total > MAX_HISTORY_CHARS:
+            break
+        history.append({"role": msg["role"], "content": content})
+    history.reverse()
+    return history
+
+
+async def answer_question(context, question: str, mode: str, chat_history: str, stream: bool, authorization: Optional[str]):
+    """
+    Shared body of the /ask endpoints: awaits the context coroutine alongside the
+    personalization lookup, runs the requested mode and shapes the (streamed) response
+    """
+    mode_fn = ASK_MODES.get(mode)
+    if mode_fn is None:
+        context.close()  # never awaited
         raise HTTPException(400, "Invalid mode")
     
+    history = parse_chat_history(chat_history)
+    personalization, context = await asyncio.gather(personalization_for(authorization), context)
+    
+    response = await mode_fn(context, question, history, personalization, stream)
+    if stream:
+        return sse_response(response, question=question, mode=mode)
     return {'question': question, 'mode': mode, 'response': response}
 
 
+@app.post("/lectures/{lecture_id}/ask")
+async def ask_lecture_question(
+    lecture_id: str,
+    question: str = Form(...),
+    mode: str = Form("tutor"),
+    chat_history: str = Form("[]"),
+    stream: bool = Form(False),
+    authorization: Optional[str] = Header(None)
+):
+    """AI study assistant (personalized)"""
+    return await answer_question(build_lecture_context(lecture_id), question, mode, chat_history, stream, authorization)
+
+
+@app.post("/topics/{topic_id}/ask")
+async def ask_topic_question(
+    topic_id: str,
+    question: str = Form(...),
+    mode: str = Form("tutor"),
+    chat_history: str = Form("[]"),
+    stream: bool = Form(False),
+    authorization: Optional[str] = Header(None)
+):
+    """AI study assistant for topic (personalized)"""
+    return await answer_question(topic_context_for(topic_id, question), question, mode, chat_history, stream, authorization)
+
+
 @app.post("/subjects/{subject_id}/ask")
 async def ask_subject_question(
     subject_id: str,
     question: str = Form(...),
     chat_history: str = Form("[]"),
+    stream: bool = Form(False),
     authorization: Optional[str] = Header(None)
 ):
     """AI tutor for subject (uses SUMMARIES to reduce token usage)"""
-    
-    user_id = await get_current_user(authorization)
-    personalization = ""
-    if user_id:
-        profile = get_learned_profile(user_id)
-        personalization = build_personalization_from_profile(profile)
-    
-    try:
-        history = json.loads(chat_history)[-10:]
-    except:
-        history = []
-    
-    topics = supabase.table('topics').select('id').eq('subject_id', subject_id).execute()
-    if not topics.data:
-        raise HTTPException(404, "No topics")
-    
-    topic_ids = [t['id'] for t in topics.data]
-    
-    # Fetch lectures with SUMMARY instead of full transcript
-    lectures = supabase.table('lectures')\
-        .select('title, summary, cleaned_transcript')\
-        .in_('topic_id', topic_ids).execute()
-    
-    if not lectures.data:
-        raise HTTPException(404, "No lectures")
-    
-    # Build context using summaries (fall back to truncated transcript if no summary)
-    context = f"SUBJECT ({len(lectures.data)} lectures) - Using summaries for efficiency:\n"
-    for i, lec in enumerate(lectures.data, 1):
-        # Use summary if available, otherwise truncate transcript
-        content = lec.get('summary') or lec['cleaned_transcript'][:3000]
-        context += f"\n--- Lecture {i}: {lec['title']} ---\n{content}"
-    
-    if len(context) > MAX_CONTEXT_CHARS:
-        raise HTTPException(400, "Subject too large (even with summaries)")
-    
-    response = await tutor_mode(context, question, history, personalization)
-    return {'question': question, 'mode': 'tutor', 'response': response}
+    return await answer_question(build_subject_context(subject_id), question, "tutor", chat_history, stream, authorization)
 
 
-async def tutor_mode(context: str, question: str, history: list = None, personalization: str = "") -> str:
-    """Answer questions (personalized with table support)"""
-    
-    system = f"""You are a helpful tutor. Answer using ONLY the provided content.
+# Mode instructions are fixed strings (never formatted per call) so every request
+# for the same material starts with a byte-identical prefix that Groq can cache
+TUTOR_INSTRUCTIONS = f"""You are a helpful tutor. Answer using ONLY the provided content.
 Be encouraging. If something isn't covered, say so.
 
 {FORMATTING_INSTRUCTIONS}
@@ -1749,33 +2334,9 @@ When answering questions that involve:
 - Comparisons → Use a TABLE to show differences/similarities
 - Multiple items with properties → Use a TABLE
 - Processes or sequences → Use NUMBERED LISTS
-- Key concepts → Use **bold** for important terms
-
-{personalization}
-
-CONTENT:
-{context}"""
-    
-    messages = [{"role": "system", "content": system}]
-    if history:
-        for msg in history:
-            if msg.get("role") in ["user", "assistant"]:
-                messages.append({"role": msg["role"], "content": msg["content"]})
-    messages.append({"role": "user", "content": question})
-    
-    response = groq_client.chat.completions.create(
-        messages=messages,
-        model="llama-3.3-70b-versatile",
-        temperature=0.7,
-        max_tokens=2000
-    )
-    return response.choices[0].message.content.strip()
-
+- Key concepts → Use **bold** for important terms"""
 
-async def practice_mode(context: str, question: str, history: list = None, personalization: str = "") -> str:
-    """Generate practice problems (personalized with table support)"""
-    
-    system = f"""Create practice problems based on this content.
+PRACTICE_INSTRUCTIONS = f"""Create practice problems based on this content.
 Generate 5-10 problems with varying difficulty.
 Include ANSWERS section at end.
 
@@ -1787,33 +2348,9 @@ Format problems clearly:
   | Option | Answer |
   |--------|--------|
   | A      | ...    |
-- Group answers in a clear ANSWERS section at the end
+- Group answers in a clear ANSWERS section at the end"""
 
-{personalization}
-
-CONTENT:
-{context}"""
-    
-    messages = [{"role": "system", "content": system}]
-    if history:
-        for msg in history:
-            if msg.get("role") in ["user", "assistant"]:
-                messages.append({"role": msg["role"], "content": msg["content"]})
-    messages.append({"role": "user", "content": question})
-    
-    response = groq_client.chat.completions.create(
-        messages=messages,
-        model="llama-3.3-70b-versatile",
-        temperature=0.8,
-        max_tokens=3000
-    )
-    return response.choices[0].message.content.strip()
-
-
-async def exam_mode(context: str, question: str, history: list = None, personalization: str = "") -> str:
-    """Generate mock exam (personalized with table support)"""
-    
-    system = f"""Create a mock exam based on this content.
+EXAM_INSTRUCTIONS = f"""Create a mock exam based on this content.
 Include 15-25 questions: multiple choice, true/false, short answer.
 Include ANSWER KEY at end.
 
@@ -1826,27 +2363,46 @@ Format the exam professionally:
 - Use a TABLE for the answer key:
   | Question | Answer | Explanation |
   |----------|--------|-------------|
-  | 1        | B      | Brief why   |
+  | 1        | B      | Brief why   |"""
 
-{personalization}
 
-CONTENT:
-{context}"""
-    
-    messages = [{"role": "system", "content": system}]
+def build_chat_messages(instructions: str, context: str, question: str,
+                        history: list = None, personalization: str = "") -> list:
+    """
+    Chat messages ordered for Groq prompt caching: fixed instructions and the content
+    first (shared by everyone studying the same material), then the per-user
+    personalization, the conversation so far and the new question.
+    """
+    messages = [{"role": "system", "content": f"{instructions}\n\nCONTENT:\n{context}"}]
+    if personalization:
+        messages.append({"role": "system", "content": personalization.strip()})
     if history:
         for msg in history:
             if msg.get("role") in ["user", "assistant"]:
                 messages.append({"role": msg["role"], "content": msg["content"]})
     messages.append({"role": "user", "content": question})
-    
-    response = groq_client.chat.completions.create(
-        messages=messages,
-        model="llama-3.3-70b-versatile",
-        temperature=0.7,
-        max_tokens=4000
-    )
-    return response.choices[0].message.content.strip()
+    return messages
+
+
+async def tutor_mode(context: str, question: str, history: list = None, personalization: str = "", stream: bool = False):
+    """Answer questions (personalized with table support)"""
+    messages = build_chat_messages(TUTOR_INSTRUCTIONS, context, question, history, personalization)
+    return await chat_completion(messages, temperature=0.7, max_tokens=2000, stream=stream, fuzzy_question=True)
+
+
+async def practice_mode(context: str, question: str, history: list = None, personalization: str = "", stream: bool = False):
+    """Generate practice problems (personalized with table support)"""
+    messages = build_chat_messages(PRACTICE_INSTRUCTIONS, context, question, history, personalization)
+    return await chat_completion(messages, temperature=0.8, max_tokens=3000, stream=stream, fuzzy_question=True)
+
+
+async def exam_mode(context: str, question: str, history: list = None, personalization: str = "", stream: bool = False):
+    """Generate mock exam (personalized with table support)"""
+    messages = build_chat_messages(EXAM_INSTRUCTIONS, context, question, history, personalization)
+    return await chat_completion(messages, temperature=0.7, max_tokens=4000, stream=stream, fuzzy_question=True)
+
+
+ASK_MODES = {'tutor': tutor_mode, 'practice': practice_mode, 'exam': exam_mode}
 
 
 # ============================================
@@ -1854,63 +2410,60 @@ CONTENT:
 # ============================================
 
 @app.post("/topics/{topic_id}/quiz")
-async def generate_topic_quiz(topic_id: str, num_questions: int = Form(20)):
-    lectures = supabase.table('lectures')\
-        .select('title, cleaned_transcript')\
-        .eq('topic_id', topic_id).execute()
+async def generate_topic_quiz(topic_id: str, num_questions: int = Form(20), stream: bool = Form(False)):
+    lectures = await run_query(
+        supabase.table('lecture_previews')
+            .select('title, transcript_head')
+            .eq('topic_id', topic_id)
+    )
     
     if not lectures.data:
         raise HTTPException(404, "No lectures")
     
-    content = "TOPIC:\n"
-    for i, lec in enumerate(lectures.data, 1):
-        content += f"\n--- {lec['title']} ---\n{lec['cleaned_transcript']}"
+    content = "TOPIC:\n" + "".join(
+        f"\n--- {lec['title']} ---\n{lec['transcript_head']}" for lec in lectures.data
+    )
     
-    quiz = await generate_quiz(content[:15000], num_questions)
+    quiz = await generate_quiz(content[:15000], num_questions, stream)
+    if stream:
+        return sse_response(quiz, topic_id=topic_id)
     return {'topic_id': topic_id, 'quiz': quiz}
 
 
 @app.post("/subjects/{subject_id}/quiz")
-async def generate_subject_quiz(subject_id: str, num_questions: int = Form(30)):
-    topics = supabase.table('topics').select('id').eq('subject_id', subject_id).execute()
-    if not topics.data:
-        raise HTTPException(404, "No topics")
-    
-    topic_ids = [t['id'] for t in topics.data]
-    lectures = supabase.table('lectures')\
-        .select('title, cleaned_transcript')\
-        .in_('topic_id', topic_ids).execute()
+async def generate_subject_quiz(subject_id: str, num_questions: int = Form(30), stream: bool = Form(False)):
+    lectures = await run_query(
+        supabase.table('lecture_previews')
+            .select('title, transcript_head')
+            .eq('subject_id', subject_id)
+    )
     
     if not lectures.data:
         raise HTTPException(404, "No lectures")
     
-    content = "SUBJECT:\n"
-    for lec in lectures.data:
-        content += f"\n--- {lec['title']} ---\n{lec['cleaned_transcript']}"
+    content = "SUBJECT:\n" + "".join(
+        f"\n--- {lec['title']} ---\n{lec['transcript_head']}" for lec in lectures.data
+    )
     
-    quiz = await generate_quiz(content[:15000], num_questions)
+    quiz = await generate_quiz(content[:15000], num_questions, stream)
+    if stream:
+        return sse_response(quiz, subject_id=subject_id)
     return {'subject_id': subject_id, 'quiz': quiz}
 
 
-async def generate_quiz(content: str, num_questions: int) -> str:
-    prompt = f"""Create {num_questions} quiz questions. Include multiple choice, true/false, short answer.
+QUIZ_INSTRUCTIONS = f"""Create quiz questions from the content. Include multiple choice, true/false, short answer.
 
 {FORMATTING_INSTRUCTIONS}
 
 Use a TABLE for the answer key at the end:
 | Q# | Answer | Brief Explanation |
-|----|--------|-------------------|
+|----|--------|-------------------|"""
 
-CONTENT:
-{content}"""
-    
-    response = groq_client.chat.completions.create(
-        messages=[{"role": "user", "content": prompt}],
-        model="llama-3.3-70b-versatile",
-        temperature=0.7,
-        max_tokens=4096
-    )
-    return response.choices[0].message.content.strip()
+
+async def generate_quiz(content: str, num_questions: int, stream: bool = False):
+    # The question count goes last so quizzes of any size share the cached prefix
+    messages = build_chat_messages(QUIZ_INSTRUCTIONS, content, f"Create {num_questions} quiz questions.")
+    return await chat_completion(messages, temperature=0.7, max_tokens=4096, stream=stream)
 
 
 @app.get("/")
@@ -1935,19 +2488,30 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/stats/prompt-cache")
+async def prompt_cache_statistics():
+    """Groq prompt cache totals for this process since startup"""
+    return {
+        **prompt_cache_stats,
+        'cache_hit_ratio': round(prompt_cache_stats['cached_tokens'] / max(prompt_cache_stats['prompt_tokens'], 1), 3)
+    }
+
+
 @app.post("/pdf/preview")
 async def preview_pdf(pdf: UploadFile = File(...)):
     """Preview PDF - returns page count and first few lines of each page for selection"""
     if not pdf.filename.lower().endswith('.pdf'):
         raise HTTPException(400, "Must be PDF")
     
+    pdf_path = None
     try:
-        pdf_content = await pdf.read()
-        pdf_reader = PdfReader(io.BytesIO(pdf_content))
+        # Stream the upload to disk; PDFium opens it by path
+        pdf_path = await save_upload_to_temp(pdf)
+        total_pages = await count_pdf_pages(pdf_path)
+        page_texts = await extract_pdf_text(pdf_path, list(range(1, total_pages + 1)))
         
         pages_preview = []
-        for i, page in enumerate(pdf_reader.pages):
-            text = page.extract_text() or ""
+        for i, text in enumerate(page_texts):
             # Get first 200 chars as preview
             preview = text[:200].strip().replace('\n', ' ')
             if len(text) > 200:
@@ -1961,8 +2525,11 @@ async def preview_pdf(pdf: UploadFile = File(...)):
         
         return {
             'filename': pdf.filename,
-            'total_pages': len(pdf_reader.pages),
+            'total_pages': total_pages,
             'pages': pages_preview
         }
     except Exception as e:
-        raise HTTPException(400, f"Failed to read PDF: {str(e)}")
\ No newline at end of file
+        raise HTTPException(400, f"Failed to read PDF: {str(e)}")
+    finally:
+        if pdf_path:
+            os.unlink(pdf_path)
\ No newline at end of file
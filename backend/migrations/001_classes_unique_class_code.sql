@@ -0,0 +1,5 @@
+-- Class codes are generated by the API and must be unique.
+-- create_class relies on this constraint (unique_violation -> retry with a new code)
+-- instead of checking for an existing code before every insert.
+ALTER TABLE classes
+    ADD CONSTRAINT classes_class_code_key UNIQUE (class_code);
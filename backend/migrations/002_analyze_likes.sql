@@ -0,0 +1,30 @@
+-- Aggregates a user's pending liked_responses on the server so
+-- maybe_analyze_and_update_profile receives one row of totals
+-- instead of every liked response (including response_content).
+CREATE OR REPLACE FUNCTION analyze_likes(uid uuid)
+RETURNS TABLE (
+    like_count bigint,
+    total_length bigint,
+    bullet_count bigint,
+    numbered_count bigint,
+    example_count bigint,
+    analogy_count bigint,
+    definition_count bigint,
+    total_steps bigint,
+    total_examples bigint
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT
+        count(*),
+        coalesce(sum(response_length), 0),
+        count(*) FILTER (WHERE has_bullet_points),
+        count(*) FILTER (WHERE has_numbered_steps),
+        count(*) FILTER (WHERE has_examples),
+        count(*) FILTER (WHERE has_analogies),
+        count(*) FILTER (WHERE has_definitions),
+        coalesce(sum(step_count), 0),
+        coalesce(sum(example_count), 0)
+    FROM liked_responses
+    WHERE user_id = uid;
+$$;
@@ -0,0 +1,28 @@
+-- Inserts a batch of liked responses and returns, in the same round trip,
+-- how many likes are now pending analysis for each user in the batch.
+-- Used by LikeBatcher so /responses/like needs no separate count query.
+CREATE OR REPLACE FUNCTION record_likes(likes jsonb)
+RETURNS TABLE (uid uuid, pending_likes bigint)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO liked_responses (
+        user_id, response_content, response_length, question_asked, mode,
+        has_bullet_points, has_numbered_steps, has_examples, has_analogies,
+        has_definitions, step_count, example_count
+    )
+    SELECT
+        r.user_id, r.response_content, r.response_length, r.question_asked, r.mode,
+        r.has_bullet_points, r.has_numbered_steps, r.has_examples, r.has_analogies,
+        r.has_definitions, r.step_count, r.example_count
+    FROM jsonb_populate_recordset(NULL::liked_responses, likes) AS r;
+
+    RETURN QUERY
+    SELECT l.user_id, count(*)
+    FROM liked_responses AS l
+    WHERE l.user_id IN (
+        SELECT (item->>'user_id')::uuid FROM jsonb_array_elements(likes) AS item
+    )
+    GROUP BY l.user_id;
+END;
+$$;
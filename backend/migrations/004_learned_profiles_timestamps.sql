@@ -0,0 +1,22 @@
+-- Let Postgres stamp learned_profiles so the backend no longer sends
+-- datetime.now() strings. Profiles are only written by an analysis,
+-- so every insert/update also marks last_analyzed_at.
+ALTER TABLE learned_profiles
+    ALTER COLUMN last_analyzed_at SET DEFAULT now(),
+    ALTER COLUMN updated_at SET DEFAULT now();
+
+CREATE OR REPLACE FUNCTION touch_learned_profile()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.last_analyzed_at := now();
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS learned_profiles_touch ON learned_profiles;
+CREATE TRIGGER learned_profiles_touch
+    BEFORE UPDATE ON learned_profiles
+    FOR EACH ROW EXECUTE FUNCTION touch_learned_profile();
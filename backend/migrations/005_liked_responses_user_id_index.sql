@@ -0,0 +1,5 @@
+-- analyze_likes(), record_likes() and the post-analysis delete all
+-- filter liked_responses by user_id; index it so they touch only that
+-- user's few pending rows instead of scanning the table.
+CREATE INDEX IF NOT EXISTS liked_responses_user_id_idx
+    ON liked_responses (user_id);
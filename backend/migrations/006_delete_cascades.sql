@@ -0,0 +1,54 @@
+-- Delete a topic or a whole subject (with their lectures and materials)
+-- in one call, instead of one PostgREST request per table.
+
+CREATE OR REPLACE FUNCTION delete_topic_cascade(tid uuid)
+RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    deleted_lectures int;
+BEGIN
+    DELETE FROM materials
+    WHERE topic_id = tid
+       OR lecture_id IN (SELECT id FROM lectures WHERE topic_id = tid);
+
+    WITH d AS (DELETE FROM lectures WHERE topic_id = tid RETURNING 1)
+    SELECT count(*) INTO deleted_lectures FROM d;
+
+    DELETE FROM topics WHERE id = tid;
+
+    RETURN jsonb_build_object('deleted_lectures', deleted_lectures);
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION delete_subject_cascade(sid uuid)
+RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    deleted_lectures int;
+    deleted_topics int;
+BEGIN
+    DELETE FROM materials
+    WHERE topic_id IN (SELECT id FROM topics WHERE subject_id = sid)
+       OR lecture_id IN (
+            SELECT l.id FROM lectures l
+            JOIN topics t ON t.id = l.topic_id
+            WHERE t.subject_id = sid
+       );
+
+    WITH d AS (
+        DELETE FROM lectures
+        WHERE topic_id IN (SELECT id FROM topics WHERE subject_id = sid)
+        RETURNING 1
+    )
+    SELECT count(*) INTO deleted_lectures FROM d;
+
+    WITH d AS (DELETE FROM topics WHERE subject_id = sid RETURNING 1)
+    SELECT count(*) INTO deleted_topics FROM d;
+
+    DELETE FROM subjects WHERE id = sid;
+
+    RETURN jsonb_build_object('deleted_topics', deleted_topics, 'deleted_lectures', deleted_lectures);
+END;
+$$;
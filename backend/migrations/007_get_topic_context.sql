@@ -0,0 +1,26 @@
+-- Everything ask_topic_question puts in the prompt, in one call:
+-- the topic's lectures plus topic-level and lecture-level materials.
+-- Keys match the table columns so the backend can use the rows as-is.
+CREATE OR REPLACE FUNCTION get_topic_context(tid uuid)
+RETURNS jsonb
+LANGUAGE sql STABLE
+AS $$
+    SELECT jsonb_build_object(
+        'lectures', coalesce((
+            SELECT jsonb_agg(jsonb_build_object('title', title, 'cleaned_transcript', cleaned_transcript) ORDER BY created_at)
+            FROM lectures
+            WHERE topic_id = tid
+        ), '[]'::jsonb),
+        'topic_materials', coalesce((
+            SELECT jsonb_agg(jsonb_build_object('file_name', file_name, 'extracted_text', extracted_text))
+            FROM materials
+            WHERE topic_id = tid
+        ), '[]'::jsonb),
+        'lecture_materials', coalesce((
+            SELECT jsonb_agg(jsonb_build_object('file_name', m.file_name, 'extracted_text', m.extracted_text))
+            FROM materials m
+            JOIN lectures l ON l.id = m.lecture_id
+            WHERE l.topic_id = tid
+        ), '[]'::jsonb)
+    );
+$$;
@@ -0,0 +1,21 @@
+-- Lectures with their transcripts cut down to what the subject-level
+-- endpoints actually use, so PostgREST doesn't ship whole transcripts
+-- just for the backend to slice them:
+--   transcript_preview - first 3000 chars, only when there's no summary
+--                        (ask_subject_question falls back to it)
+--   transcript_head    - first 15000 chars (quiz content is capped at 15000)
+-- subject_id is joined in so subject queries need no topics lookup first.
+CREATE OR REPLACE VIEW lecture_previews
+WITH (security_invoker = true)
+AS
+SELECT
+    l.id,
+    l.topic_id,
+    t.subject_id,
+    l.title,
+    l.summary,
+    CASE WHEN coalesce(l.summary, '') = '' THEN left(l.cleaned_transcript, 3000) END AS transcript_preview,
+    left(l.cleaned_transcript, 15000) AS transcript_head,
+    l.created_at
+FROM lectures l
+JOIN topics t ON t.id = l.topic_id;
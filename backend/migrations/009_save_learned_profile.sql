@@ -0,0 +1,36 @@
+-- Saves a freshly analyzed learned profile and clears the liked_responses
+-- it was computed from, in one call and one transaction (previously an
+-- update/insert request followed by a separate delete request).
+CREATE OR REPLACE FUNCTION save_learned_profile(uid uuid, scores jsonb)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    p learned_profiles;
+BEGIN
+    p := jsonb_populate_record(NULL::learned_profiles, scores);
+
+    UPDATE learned_profiles SET
+        visual_score = p.visual_score,
+        verbal_score = p.verbal_score,
+        reading_writing_score = p.reading_writing_score,
+        theory_vs_example = p.theory_vs_example,
+        detail_level = p.detail_level,
+        structure_preference = p.structure_preference,
+        total_likes = p.total_likes
+    WHERE user_id = uid;
+
+    IF NOT FOUND THEN
+        INSERT INTO learned_profiles (
+            user_id, visual_score, verbal_score, reading_writing_score,
+            theory_vs_example, detail_level, structure_preference, total_likes
+        )
+        VALUES (
+            uid, p.visual_score, p.verbal_score, p.reading_writing_score,
+            p.theory_vs_example, p.detail_level, p.structure_preference, p.total_likes
+        );
+    END IF;
+
+    DELETE FROM liked_responses WHERE user_id = uid;
+END;
+$$;
@@ -0,0 +1,25 @@
+-- Creates a class and its teacher membership in one call and one
+-- transaction. A taken class code still raises unique_violation (23505)
+-- from classes_class_code_key, so create_class retries with a new code.
+CREATE OR REPLACE FUNCTION create_class_with_owner(
+    class_name text,
+    class_description text,
+    owner uuid,
+    code text
+)
+RETURNS uuid
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    new_id uuid;
+BEGIN
+    INSERT INTO classes (name, description, class_code, created_by)
+    VALUES (class_name, class_description, code, owner)
+    RETURNING id INTO new_id;
+
+    INSERT INTO class_members (user_id, class_id, role)
+    VALUES (owner, new_id, 'teacher');
+
+    RETURN new_id;
+END;
+$$;
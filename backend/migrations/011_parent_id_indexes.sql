@@ -0,0 +1,10 @@
+-- Postgres does not index foreign key columns on its own. The embedded
+-- child counts (subjects(count), topics(count), lectures(count)), the
+-- class/topic listings and the delete cascades all look rows up by
+-- their parent id, so index those columns to make each count an
+-- index-only lookup instead of a scan of the child table.
+CREATE INDEX IF NOT EXISTS subjects_class_id_idx ON subjects (class_id);
+CREATE INDEX IF NOT EXISTS topics_subject_id_idx ON topics (subject_id);
+CREATE INDEX IF NOT EXISTS lectures_topic_id_idx ON lectures (topic_id);
+CREATE INDEX IF NOT EXISTS materials_lecture_id_idx ON materials (lecture_id);
+CREATE INDEX IF NOT EXISTS materials_topic_id_idx ON materials (topic_id);
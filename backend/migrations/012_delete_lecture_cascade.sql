@@ -0,0 +1,11 @@
+-- Delete a lecture and its materials in one call, like
+-- delete_topic_cascade / delete_subject_cascade.
+CREATE OR REPLACE FUNCTION delete_lecture_cascade(lid uuid)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    DELETE FROM materials WHERE lecture_id = lid;
+    DELETE FROM lectures WHERE id = lid;
+END;
+$$;
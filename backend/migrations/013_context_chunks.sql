@@ -0,0 +1,116 @@
+-- Searchable chunks of every transcript and material, so a topic that is too
+-- large to send whole can still be answered from its most relevant excerpts.
+-- Chunks are kept in sync by triggers and removed with their lecture/material.
+-- 'simple' text search config because transcripts come in several languages.
+
+CREATE TABLE IF NOT EXISTS context_chunks (
+    id bigserial PRIMARY KEY,
+    lecture_id uuid REFERENCES lectures(id) ON DELETE CASCADE,
+    material_id uuid REFERENCES materials(id) ON DELETE CASCADE,
+    source text NOT NULL,
+    chunk_index int NOT NULL,
+    content text NOT NULL,
+    tsv tsvector GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED
+);
+
+CREATE INDEX IF NOT EXISTS context_chunks_tsv_idx ON context_chunks USING gin (tsv);
+CREATE INDEX IF NOT EXISTS context_chunks_lecture_id_idx ON context_chunks (lecture_id);
+CREATE INDEX IF NOT EXISTS context_chunks_material_id_idx ON context_chunks (material_id);
+
+-- Fixed-size windows, cut at the last whitespace so words stay whole
+CREATE OR REPLACE FUNCTION split_into_chunks(body text, chunk_size int DEFAULT 2000)
+RETURNS TABLE (chunk_index int, content text)
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+DECLARE
+    pos int := 1;
+    idx int := 0;
+    piece text;
+    cut int;
+BEGIN
+    WHILE body IS NOT NULL AND pos <= length(body) LOOP
+        piece := substr(body, pos, chunk_size);
+        IF pos + chunk_size <= length(body) THEN
+            cut := length(piece) - position(' ' IN reverse(replace(piece, E'\n', ' ')));
+            IF cut > chunk_size / 2 THEN
+                piece := left(piece, cut);
+            END IF;
+        END IF;
+        chunk_index := idx;
+        content := piece;
+        RETURN NEXT;
+        pos := pos + length(piece);
+        idx := idx + 1;
+    END LOOP;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION sync_lecture_chunks()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    DELETE FROM context_chunks WHERE lecture_id = NEW.id;
+    INSERT INTO context_chunks (lecture_id, source, chunk_index, content)
+    SELECT NEW.id, 'Lecture: ' || NEW.title, c.chunk_index, c.content
+    FROM split_into_chunks(NEW.cleaned_transcript) c;
+    RETURN NEW;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION sync_material_chunks()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    DELETE FROM context_chunks WHERE material_id = NEW.id;
+    INSERT INTO context_chunks (material_id, source, chunk_index, content)
+    SELECT NEW.id, NEW.file_name, c.chunk_index, c.content
+    FROM split_into_chunks(NEW.extracted_text) c;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS lectures_sync_chunks ON lectures;
+CREATE TRIGGER lectures_sync_chunks
+    AFTER INSERT OR UPDATE OF title, cleaned_transcript ON lectures
+    FOR EACH ROW EXECUTE FUNCTION sync_lecture_chunks();
+
+DROP TRIGGER IF EXISTS materials_sync_chunks ON materials;
+CREATE TRIGGER materials_sync_chunks
+    AFTER INSERT OR UPDATE OF file_name, extracted_text ON materials
+    FOR EACH ROW EXECUTE FUNCTION sync_material_chunks();
+
+-- Backfill existing rows (no-op updates fire the triggers above)
+UPDATE lectures SET cleaned_transcript = cleaned_transcript;
+UPDATE materials SET extracted_text = extracted_text;
+
+-- The k chunks of a topic (its lectures, their materials and topic-level
+-- materials) that share the most words with the question, in reading order
+CREATE OR REPLACE FUNCTION match_topic_chunks(tid uuid, query text, k int DEFAULT 20)
+RETURNS TABLE (source text, content text)
+LANGUAGE sql STABLE
+AS $$
+    WITH q AS (
+        -- Any word may match; ts_rank_cd favours chunks matching more of them
+        SELECT nullif(replace(plainto_tsquery('simple', query)::text, ' & ', ' | '), '')::tsquery AS tsq
+    ),
+    topic_chunks AS (
+        SELECT c.* FROM context_chunks c
+        JOIN lectures l ON l.id = c.lecture_id
+        WHERE l.topic_id = tid
+        UNION ALL
+        SELECT c.* FROM context_chunks c
+        JOIN materials m ON m.id = c.material_id
+        LEFT JOIN lectures l ON l.id = m.lecture_id
+        WHERE m.topic_id = tid OR l.topic_id = tid
+    ),
+    best AS (
+        SELECT t.id, t.source, t.content, ts_rank_cd(t.tsv, q.tsq) AS rank
+        FROM topic_chunks t, q
+        WHERE t.tsv @@ q.tsq
+        ORDER BY rank DESC
+        LIMIT k
+    )
+    SELECT source, content FROM best ORDER BY id;
+$$;
@@ -0,0 +1,9 @@
+-- Lecture listings are sorted by created_at: all lectures newest first
+-- (GET /lectures, keyset-paginated with ?before=) and a topic's lectures
+-- oldest first. With these indexes both read rows in index order instead
+-- of sorting the table.
+CREATE INDEX IF NOT EXISTS lectures_created_at_idx ON lectures (created_at DESC);
+
+-- Serves every topic_id lookup too, so it replaces the single-column index from 011
+CREATE INDEX IF NOT EXISTS lectures_topic_id_created_at_idx ON lectures (topic_id, created_at);
+DROP INDEX IF EXISTS lectures_topic_id_idx;
@@ -0,0 +1,6 @@
+-- Transcription returns as soon as the raw transcript is saved; cleaning and
+-- the summary finish in the background. 'processing' until then, 'ready' after
+-- ('failed' if the update could not be made). Existing lectures are complete.
+ALTER TABLE lectures
+    ADD COLUMN IF NOT EXISTS processing_status text NOT NULL DEFAULT 'ready'
+    CHECK (processing_status IN ('processing', 'ready', 'failed'));
@@ -0,0 +1,75 @@
+-- save_learned_profile() used to delete every pending like of the user,
+-- including likes recorded after analyze_likes() had summed them up, so
+-- those were never counted. analyze_likes() now also returns the ids it
+-- covered, and save_learned_profile() deletes only those rows.
+
+DROP FUNCTION IF EXISTS analyze_likes(uuid);
+
+CREATE FUNCTION analyze_likes(uid uuid)
+RETURNS TABLE (
+    like_count bigint,
+    total_length bigint,
+    bullet_count bigint,
+    numbered_count bigint,
+    example_count bigint,
+    analogy_count bigint,
+    definition_count bigint,
+    total_steps bigint,
+    total_examples bigint,
+    liked_ids jsonb
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT
+        count(*),
+        coalesce(sum(response_length), 0),
+        count(*) FILTER (WHERE has_bullet_points),
+        count(*) FILTER (WHERE has_numbered_steps),
+        count(*) FILTER (WHERE has_examples),
+        count(*) FILTER (WHERE has_analogies),
+        count(*) FILTER (WHERE has_definitions),
+        coalesce(sum(step_count), 0),
+        coalesce(sum(example_count), 0),
+        coalesce(jsonb_agg(id), '[]'::jsonb)
+    FROM liked_responses
+    WHERE user_id = uid;
+$$;
+
+DROP FUNCTION IF EXISTS save_learned_profile(uuid, jsonb);
+
+CREATE FUNCTION save_learned_profile(uid uuid, scores jsonb, liked_ids jsonb)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    p learned_profiles;
+BEGIN
+    p := jsonb_populate_record(NULL::learned_profiles, scores);
+
+    UPDATE learned_profiles SET
+        visual_score = p.visual_score,
+        verbal_score = p.verbal_score,
+        reading_writing_score = p.reading_writing_score,
+        theory_vs_example = p.theory_vs_example,
+        detail_level = p.detail_level,
+        structure_preference = p.structure_preference,
+        total_likes = p.total_likes
+    WHERE user_id = uid;
+
+    IF NOT FOUND THEN
+        INSERT INTO learned_profiles (
+            user_id, visual_score, verbal_score, reading_writing_score,
+            theory_vs_example, detail_level, structure_preference, total_likes
+        )
+        VALUES (
+            uid, p.visual_score, p.verbal_score, p.reading_writing_score,
+            p.theory_vs_example, p.detail_level, p.structure_preference, p.total_likes
+        );
+    END IF;
+
+    -- Only the likes this profile was computed from; newer ones stay pending
+    DELETE FROM liked_responses
+    WHERE user_id = uid
+      AND id::text IN (SELECT jsonb_array_elements_text(liked_ids));
+END;
+$$;
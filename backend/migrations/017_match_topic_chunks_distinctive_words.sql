@@ -0,0 +1,72 @@
+-- match_topic_chunks() from 013 OR-ed every word of the question. The
+-- 'simple' config keeps stopwords, so "what is the difference between X
+-- and Y" matched nearly every chunk through what/is/the/and, and ranking
+-- favoured stopword-dense chunks. Now chunks containing every question
+-- word are preferred; only when there are none does it fall back to
+-- matching any *distinctive* word: 3+ characters and present in at most
+-- half of the topic's chunks.
+
+-- A topic's chunks: its lectures, their materials and topic-level materials
+CREATE OR REPLACE FUNCTION topic_chunks(tid uuid)
+RETURNS SETOF context_chunks
+LANGUAGE sql STABLE
+AS $$
+    SELECT c.* FROM context_chunks c
+    JOIN lectures l ON l.id = c.lecture_id
+    WHERE l.topic_id = tid
+    UNION ALL
+    SELECT c.* FROM context_chunks c
+    JOIN materials m ON m.id = c.material_id
+    LEFT JOIN lectures l ON l.id = m.lecture_id
+    WHERE m.topic_id = tid OR l.topic_id = tid;
+$$;
+
+-- The k best-ranked chunks of a topic matching tsq, in reading order
+CREATE OR REPLACE FUNCTION rank_topic_chunks(tid uuid, tsq tsquery, k int)
+RETURNS TABLE (source text, content text)
+LANGUAGE sql STABLE
+AS $$
+    SELECT best.source, best.content
+    FROM (
+        SELECT t.id, t.source, t.content
+        FROM topic_chunks(tid) t
+        WHERE t.tsv @@ tsq
+        ORDER BY ts_rank_cd(t.tsv, tsq) DESC
+        LIMIT k
+    ) best
+    ORDER BY best.id;
+$$;
+
+CREATE OR REPLACE FUNCTION match_topic_chunks(tid uuid, query text, k int DEFAULT 20)
+RETURNS TABLE (source text, content text)
+LANGUAGE plpgsql STABLE
+AS $$
+DECLARE
+    chunk_total bigint;
+    any_word tsquery;
+BEGIN
+    -- Chunks containing every word of the question
+    RETURN QUERY SELECT r.source, r.content FROM rank_topic_chunks(tid, plainto_tsquery('simple', query), k) r;
+    IF FOUND THEN
+        RETURN;
+    END IF;
+
+    SELECT count(*) INTO chunk_total FROM topic_chunks(tid);
+
+    -- Otherwise any distinctive word (skips stopwords by document frequency,
+    -- which works whatever language the lecture is in)
+    SELECT string_agg(quote_literal(w.lexeme), ' | ')::tsquery INTO any_word
+    FROM unnest(to_tsvector('simple', query)) w
+    WHERE length(w.lexeme) >= 3
+      AND (
+          SELECT count(*) FROM topic_chunks(tid) t
+          WHERE t.tsv @@ quote_literal(w.lexeme)::tsquery
+      ) <= greatest(1, chunk_total / 2);
+
+    IF any_word IS NULL THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY SELECT r.source, r.content FROM rank_topic_chunks(tid, any_word, k) r;
+END;
+$$;
@@ -7,6 +7,7 @@ import Link from 'next/link';
 import { useParams } from 'next/navigation';
 import { useAuth, getApiUrl } from '../../../context/AuthContext';
 import MarkdownRenderer from '../../../components/MarkdownRenderer';
+import { readAnswerStream } from '../../../lib/readAnswerStream';
 
 const API_URL = getApiUrl();
 
@@ -70,6 +71,7 @@ export default function StudyPage() {
     formData.append('question', question);
     formData.append('mode', mode);
     formData.append('chat_history', JSON.stringify(messages));
+    formData.append('stream', 'true');
 
     try {
       const response = await authFetch(`${API_URL}/lectures/${lectureId}/ask`, {
@@ -82,15 +84,17 @@ export default function StudyPage() {
         throw new Error(errorData.detail || 'Failed to get response');
       }
 
-      const data = await response.json();
+      // Render the answer as it streams in
       const aiMessage = {
         role: 'assistant',
-        content: data.response,
+        content: '',
         mode: mode,
         liked: false,
         questionAsked: question
       };
-      setMessages([...updatedMessages, aiMessage]);
+      await readAnswerStream(response, (text) => {
+        setMessages([...updatedMessages, { ...aiMessage, content: text }]);
+      });
       setQuestion('');
     } catch (err) {
       alert(`Error: ${err.message}`);
@@ -261,7 +265,7 @@ export default function StudyPage() {
             </div>
           ))}
 
-          {loading && <div style={styles.loadingMessage}>🤖 Thinking...</div>}
+          {loading && messages[messages.length - 1]?.role !== 'assistant' && <div style={styles.loadingMessage}>🤖 Thinking...</div>}
           <div ref={messagesEndRef} />
         </div>
 
@@ -0,0 +1,32 @@
+// frontend/app/lib/readAnswerStream.js
+
+// Reads the Server-Sent Events sent by the /ask endpoints when called with stream=true.
+// Calls onText with the answer so far after every delta and resolves to the full answer.
+export async function readAnswerStream(response, onText) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let answer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop(); // keep any partial event for the next read
+
+    for (const event of events) {
+      const data = event.replace(/^data: /, '');
+      if (data === '[DONE]') return answer;
+
+      const payload = JSON.parse(data);
+      if (payload.delta) {
+        answer += payload.delta;
+        onText(answer);
+      }
+    }
+  }
+
+  return answer;
+}
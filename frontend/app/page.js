@@ -2,12 +2,14 @@
 
 'use client';
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import Link from 'next/link';
 import { useRouter } from 'next/navigation';
 import { useAuth, getApiUrl } from './context/AuthContext';
 
 const API_URL = getApiUrl();
+const POLL_INTERVAL_MS = 3000;
+const POLL_MAX_ATTEMPTS = 200; // Give up after ~10 minutes
 
 const LANGUAGES = [
   { code: 'en', name: 'English' },
@@ -34,6 +36,10 @@ export default function Home() {
   const [selectedTopic, setSelectedTopic] = useState('');
   const [language, setLanguage] = useState('en');
   const [uploadProgress, setUploadProgress] = useState('');
+  const pollRef = useRef(null); // AbortController of the running processing poll
+
+  // Stop polling when the page is left
+  useEffect(() => () => pollRef.current?.abort(), []);
 
   useEffect(() => {
     if (!authLoading && !isAuthenticated) {
@@ -155,12 +161,44 @@ export default function Home() {
     }
   };
 
+  // Cleaning and the summary finish after /transcribe returns;
+  // poll the lecture until they are saved, then show the cleaned preview.
+  // A new upload or leaving the page aborts the poll.
+  const pollLectureProcessing = async (data) => {
+    pollRef.current?.abort();
+    const controller = new AbortController();
+    pollRef.current = controller;
+
+    for (let attempt = 0; attempt < POLL_MAX_ATTEMPTS; attempt++) {
+      await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+      if (controller.signal.aborted) return;
+      try {
+        const response = await fetch(`${API_URL}/lectures/${data.lecture_id}`, { signal: controller.signal });
+        if (!response.ok) continue;
+        const lecture = await response.json();
+        if (lecture.processing_status === 'processing') continue;
+        setResult({
+          ...data,
+          status: lecture.processing_status,
+          transcript_preview: lecture.cleaned_transcript.slice(0, 500),
+          transcript_length: lecture.cleaned_transcript.length,
+        });
+        return;
+      } catch (err) {
+        if (controller.signal.aborted) return;
+        console.error('Failed to check lecture status:', err);
+      }
+    }
+    setResult({ ...data, status: 'timeout' });
+  };
+
   const handleUpload = async () => {
     if (files.length === 0) {
       setError('Please select at least one audio file');
       return;
     }
 
+    pollRef.current?.abort();
     setLoading(true);
     setError('');
     setResult(null);
@@ -201,6 +239,7 @@ export default function Home() {
       const data = await response.json();
       setResult(data);
       setUploadProgress('');
+      pollLectureProcessing(data);
       
     } catch (err) {
       setError(err.message);
@@ -393,7 +432,27 @@ export default function Home() {
 
         {result && (
           <div style={styles.results}>
-            <h2 style={styles.resultsTitle}>✅ Transcription Complete!</h2>
+            <h2 style={styles.resultsTitle}>
+              {result.status === 'processing' ? '⏳ Transcribed - Finishing Up...' : '✅ Transcription Complete!'}
+            </h2>
+
+            {result.status === 'processing' && (
+              <div style={styles.resultCard}>
+                <p style={styles.loadingText}>Cleaning transcript and writing summary...</p>
+              </div>
+            )}
+
+            {result.status === 'failed' && (
+              <div style={styles.resultCard}>
+                <p style={styles.loadingText}>⚠️ Cleaning or summarizing the transcript failed. The lecture keeps the transcript shown below.</p>
+              </div>
+            )}
+
+            {result.status === 'timeout' && (
+              <div style={styles.resultCard}>
+                <p style={styles.loadingText}>Cleaning is taking longer than expected. Check the lecture page later.</p>
+              </div>
+            )}
             
             <div style={styles.resultCard}>
               <strong>Lecture ID:</strong>
@@ -411,12 +470,14 @@ export default function Home() {
               {result.chunks_processed && result.chunks_processed > 1 && (
                 <><strong>Chunks processed:</strong> {result.chunks_processed}<br /></>
               )}
-              <strong>Transcript length:</strong> {result.cleaned_length.toLocaleString()} characters
+              <strong>Transcript length:</strong> {(result.transcript_length || result.raw_length).toLocaleString()} characters
             </div>
 
             <div style={styles.resultCard}>
-              <h3 style={styles.previewTitle}>Cleaned Transcript Preview:</h3>
-              <p style={styles.transcript}>{result.cleaned_preview}</p>
+              <h3 style={styles.previewTitle}>
+                {result.status === 'ready' ? 'Cleaned Transcript Preview:' : 'Transcript Preview:'}
+              </h3>
+              <p style={styles.transcript}>{result.transcript_preview}</p>
             </div>
 
             {pdfFile && !uploadingPdf && (
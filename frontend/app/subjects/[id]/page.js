@@ -6,6 +6,7 @@ import { useState, useEffect } from 'react';
 import Link from 'next/link';
 import { useParams } from 'next/navigation';
 import { getApiUrl } from '../../context/AuthContext';
+import { readAnswerStream } from '../../lib/readAnswerStream';
 
 const API_URL = getApiUrl();
 
@@ -116,6 +117,7 @@ export default function SubjectDetailPage() {
     setQuiz(null);
 
     const formData = new FormData();
+    formData.append('stream', 'true');
     formData.append('num_questions', '30');
 
     try {
@@ -126,8 +128,8 @@ export default function SubjectDetailPage() {
 
       if (!response.ok) throw new Error('Quiz generation failed');
 
-      const data = await response.json();
-      setQuiz(data.quiz);
+      // Show the quiz as it is written
+      await readAnswerStream(response, setQuiz);
     } catch (err) {
       alert(`Failed to generate quiz: ${err.message}`);
     } finally {
@@ -7,6 +7,7 @@ import Link from 'next/link';
 import { useParams } from 'next/navigation';
 import { useAuth, getApiUrl } from '../../../context/AuthContext';
 import MarkdownRenderer from '../../../components/MarkdownRenderer';
+import { readAnswerStream } from '../../../lib/readAnswerStream';
 
 const API_URL = getApiUrl();
 
@@ -68,6 +69,7 @@ export default function SubjectStudyPage() {
     const formData = new FormData();
     formData.append('question', question);
     formData.append('chat_history', JSON.stringify(messages));
+    formData.append('stream', 'true');
 
     try {
       const response = await authFetch(`${API_URL}/subjects/${subjectId}/ask`, {
@@ -80,14 +82,16 @@ export default function SubjectStudyPage() {
         throw new Error(errorData.detail || 'Failed to get response');
       }
 
-      const data = await response.json();
+      // Render the answer as it streams in
       const aiMessage = {
         role: 'assistant',
-        content: data.response,
+        content: '',
         liked: false,
         questionAsked: question
       };
-      setMessages([...updatedMessages, aiMessage]);
+      await readAnswerStream(response, (text) => {
+        setMessages([...updatedMessages, { ...aiMessage, content: text }]);
+      });
       setQuestion('');
     } catch (err) {
       alert(`Error: ${err.message}`);
@@ -235,7 +239,7 @@ export default function SubjectStudyPage() {
             </div>
           ))}
 
-          {loading && <div style={styles.loadingMessage}>🤖 Analyzing entire subject content...</div>}
+          {loading && messages[messages.length - 1]?.role !== 'assistant' && <div style={styles.loadingMessage}>🤖 Analyzing entire subject content...</div>}
           <div ref={messagesEndRef} />
         </div>
 
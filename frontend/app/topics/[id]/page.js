@@ -8,6 +8,7 @@ import Link from 'next/link';
 import { useParams, useRouter } from 'next/navigation';
 import { getApiUrl } from '../../context/AuthContext';
 import PdfUploader from '../../components/PdfUploader';
+import { readAnswerStream } from '../../lib/readAnswerStream';
 
 const API_URL = getApiUrl();
 
@@ -104,6 +105,7 @@ export default function TopicDetailPage() {
     setQuiz(null);
 
     const formData = new FormData();
+    formData.append('stream', 'true');
     formData.append('num_questions', '20');
 
     try {
@@ -114,8 +116,8 @@ export default function TopicDetailPage() {
 
       if (!response.ok) throw new Error('Quiz generation failed');
 
-      const data = await response.json();
-      setQuiz(data.quiz);
+      // Show the quiz as it is written
+      await readAnswerStream(response, setQuiz);
     } catch (err) {
       alert(`Failed to generate quiz: ${err.message}`);
     } finally {